@@ -0,0 +1,83 @@
+# Benchmark of the text cleaning in mma_word_embeddings.preprocessing against the original per-sentence routine.
+#
+# Usage:
+#   python benchmarks/cleaning.py                        # synthetic news-like corpus
+#   python benchmarks/cleaning.py data.json text 20000   # first 20000 documents of column 'text' of a json file
+#
+# The script checks that both routines produce the same tokens and prints the time each of them takes.
+import os
+import re
+import sys
+import json
+import time
+import random
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mma_word_embeddings.preprocessing import clean_documents, stop, PUNCTUATION, GARBAGE, STOPWORD_EXCEPTIONS
+
+
+def legacy_clean_sentence(sentence, remove_stopwords=False):
+    """The cleaning routine that DexterData.get_training_data() used to run on every sentence."""
+
+    sentence = re.sub(r'\b[a-z]+(?:[A-Z][a-z]+)+\b', '', sentence)
+    sentence = BeautifulSoup(sentence, "html.parser").text
+    sentence = sentence.replace(r'\xad', '')
+    sentence = sentence.replace('displayad', '')
+    sentence = ''.join(char for word in sentence for char in word
+                       if char not in PUNCTUATION and not char.isdigit())
+    sentence = sentence.split()
+    sentence = [word for word in sentence if all(g not in word for g in GARBAGE)]
+    if remove_stopwords:
+        sentence = [word for word in sentence if word not in stop or word in STOPWORD_EXCEPTIONS]
+    sentence = [word.lower() for word in sentence]
+    return sentence
+
+
+def synthetic_documents(n_documents, seed=0):
+    """Make documents that contain the kinds of noise found in scraped news articles."""
+    rng = random.Random(seed)
+    words = ["the", "minister", "said", "on", "Tuesday", "that", "she", "would", "visit", "Johannesburg", "and",
+             "Cape", "Town", "in", "2019", "“quoted”", "it's", "R1.5", "million", "he", "his", "her", "police",
+             "fooBar", "windowTextColor", "displayad", "x\\xady", "<b>bold</b>", "&amp;", "2³", "…"]
+    documents = []
+    for _ in range(n_documents):
+        sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(5, 25)))
+                     for _ in range(rng.randint(3, 15))]
+        documents.append(". ".join(sentences))
+    return documents
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            data = json.load(f)
+        column = sys.argv[2] if len(sys.argv) > 2 else "text"
+        n_documents = int(sys.argv[3]) if len(sys.argv) > 3 else len(data)
+        documents = [row[column] for row in data[:n_documents]]
+    else:
+        documents = synthetic_documents(5000)
+
+    for remove_stopwords in [False, True]:
+        start = time.perf_counter()
+        legacy = [legacy_clean_sentence(sentence, remove_stopwords=remove_stopwords)
+                  for document in documents for sentence in document.split(".")]
+        legacy_seconds = time.perf_counter() - start
+
+        cleaned, stats = clean_documents(documents, remove_stopwords=remove_stopwords, progress=None)
+
+        print("remove_stopwords={}: {} documents, {} sentences".format(remove_stopwords, len(documents),
+                                                                       len(legacy)))
+        print("   legacy:  {:.2f}s".format(legacy_seconds))
+        print("   current: {:.2f}s ({:.1f}x faster)".format(stats["seconds"], legacy_seconds / stats["seconds"]))
+
+        if cleaned != legacy:
+            n_different = sum(a != b for a, b in zip(cleaned, legacy)) + abs(len(cleaned) - len(legacy))
+            print("   WARNING: {} sentences differ (html tags that contain '.' are now kept whole).".format(
+                n_different))
+        else:
+            print("   tokens are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# This file contains a class that keeps cleaned training data on disk while it is preprocessed, so that
+# preprocessing can resume after a crash and only has to process documents appended to the source
+import os
+import json
+import gensim
+
+MANIFEST_FILE = "manifest.json"
+BIGRAM_FILE = "bigram.phrases"
+
+
+class PreprocessingCheckpoint:
+    """A directory that holds the cleaned sentences of the documents processed so far.
+
+    Every chunk of cleaned documents is written to its own file in "one-sentence-per-line" format, and the manifest
+    'manifest.json' lists the completed chunks and how many documents they cover. Since chunk files and manifest are
+    replaced atomically, the checkpoint is consistent at any time, and a run that was killed resumes after the
+    last completed chunk. Documents that were appended to the source are processed the same way, as the delta
+    after the documents already covered.
+
+    The manifest also records the settings the chunks were made with, and a checkpoint cannot be continued with
+    different settings.
+    """
+
+    def __init__(self, path, settings):
+        """
+        Args:
+            path (str): directory of the checkpoint, created if it does not exist
+            settings (dict): json-serializable settings of the preprocessing
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r', encoding='utf8') as f:
+                self.manifest = json.load(f)
+            # compare in json form, so that tuples and lists are equal
+            if self.manifest["settings"] != json.loads(json.dumps(settings)):
+                raise ValueError("The checkpoint in {} was made with the settings {}, which differ from {}. Use "
+                                 "another checkpoint directory.".format(path, self.manifest["settings"], settings))
+        else:
+            self.manifest = {"settings": settings, "n_documents": 0, "chunks": [], "bigram_chunks": 0}
+
+    @property
+    def n_documents(self):
+        """Number of documents processed so far."""
+        return self.manifest["n_documents"]
+
+    @property
+    def n_chunks(self):
+        """Number of completed chunks."""
+        return len(self.manifest["chunks"])
+
+    def _write_atomically(self, filename, write):
+        """Call write(f) on a temporary file that then replaces the file 'filename' of the checkpoint."""
+        path = os.path.join(self.path, filename)
+        with open(path + ".tmp", 'w', encoding='utf8') as f:
+            write(f)
+        os.replace(path + ".tmp", path)
+
+    def _save_manifest(self):
+        self._write_atomically(MANIFEST_FILE, lambda f: json.dump(self.manifest, f, indent=1))
+
+    def add_chunk(self, n_documents, sentences):
+        """Save the cleaned sentences of the next 'n_documents' documents as a completed chunk.
+
+        Args:
+            n_documents (int): number of documents in the chunk
+            sentences (list[list[str]]): cleaned sentences of the chunk
+        """
+
+        def write(f):
+            for sentence in sentences:
+                f.write('%s\n' % " ".join(sentence))
+
+        filename = "chunk-{:06d}.txt".format(self.n_chunks)
+        self._write_atomically(filename, write)
+
+        self.manifest["chunks"].append({"file": filename, "documents": n_documents, "sentences": len(sentences)})
+        self.manifest["n_documents"] += n_documents
+        self._save_manifest()
+
+    def __iter__(self):
+        # the checkpoint is a restartable corpus of all cleaned sentences
+        return self.sentences()
+
+    def sentences(self, first_chunk=0):
+        """Yield the cleaned sentences of all completed chunks, starting at chunk 'first_chunk'."""
+        for chunk in self.manifest["chunks"][first_chunk:]:
+            with open(os.path.join(self.path, chunk["file"]), 'r', encoding='utf8') as f:
+                for line in f:
+                    yield line.split()
+
+    def bigram(self, min_count, threshold):
+        """Return the bigram model of all completed chunks.
+
+        The model is saved in the checkpoint, and only updated with the chunks that were added since, using
+        gensim's Phrases.add_vocab(). The counts are the same as those of a model fitted on all sentences at once.
+        """
+        path = os.path.join(self.path, BIGRAM_FILE)
+        if os.path.isfile(path) and self.manifest["bigram_chunks"] > 0:
+            bigram = gensim.models.Phrases.load(path)
+        else:
+            bigram = gensim.models.Phrases(min_count=min_count, threshold=threshold)
+            self.manifest["bigram_chunks"] = 0
+
+        if self.manifest["bigram_chunks"] < self.n_chunks:
+            bigram.add_vocab(self.sentences(first_chunk=self.manifest["bigram_chunks"]))
+            bigram.save(path + ".tmp")
+            os.replace(path + ".tmp", path)
+            self.manifest["bigram_chunks"] = self.n_chunks
+            self._save_manifest()
+
+        return bigram
@@ -0,0 +1,307 @@
+# This file contains corpus classes that present training data to gensim as restartable iterables of token lists
+import os
+from array import array
+import numpy as np
+
+# number of token ids buffered before they are written to disk
+WRITE_BUFFER_SIZE = 2**20
+
+
+class LineSentenceCorpus:
+    """A corpus in "one-sentence-per-line" format that is streamed from disk.
+
+    Iterating reads the file anew, so gensim can pass over it once per epoch, and only one sentence is held in
+    memory at a time.
+    """
+
+    def __init__(self, path, work_dir=None):
+        """
+        Args:
+            path (str): path to the text file
+            work_dir (tempfile.TemporaryDirectory): temporary directory that holds the file, if any; the corpus
+                keeps a reference to it, so that the directory is deleted only once the corpus is
+        """
+        self.path = path
+        self.work_dir = work_dir
+        self._len = None
+
+    def __len__(self):
+        # count the sentences once, on first request
+        if self._len is None:
+            with open(self.path, "r") as f:
+                self._len = sum(1 for _ in f)
+        return self._len
+
+    def __iter__(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                yield line.strip().split()
+
+
+class BootstrapCorpus:
+    """A bootstrap sample of a corpus that is never materialized.
+
+    The sample is stored as the indices of the drawn documents. If the underlying corpus supports random access, like
+    a CorpusStore or a list, iterating yields the documents in the order they were drawn, so duplicates are spread
+    over the sample as in a shuffled corpus, which the learning rate decay of SGD training relies on.
+
+    Corpora that are streamed from disk, like a LineSentenceCorpus, do not support random access. For them, iterating
+    yields every document as often as it was drawn, in the order of the corpus, with the copies of a document back to
+    back. The sample holds the same documents, but training sees them in corpus order, which is why
+    TrainableModel.train() encodes such a corpus into a CorpusStore before it trains an ensemble.
+    """
+
+    def __init__(self, corpus, indices):
+        """
+        Args:
+            corpus (iterable): the underlying corpus, which must support len() and repeated iteration
+            indices (array of int): indices of the drawn documents, in the order they are yielded
+        """
+        self.corpus = corpus
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    @classmethod
+    def sample(cls, corpus, n_documents, random_state=None):
+        """Draw 'n_documents' documents from 'corpus' with replacement.
+
+        Args:
+            corpus (iterable): the underlying corpus
+            n_documents (int): size of the sample
+            random_state (np.random.RandomState): source of randomness, defaults to numpy's global state
+        """
+        randint = np.random.randint if random_state is None else random_state.randint
+        indices = randint(0, len(corpus), size=n_documents)
+        return cls(corpus, indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        if hasattr(self.corpus, "__getitem__"):
+            for idx in self.indices.tolist():
+                yield self.corpus[idx]
+        else:
+            counts = np.bincount(self.indices, minlength=len(self.corpus))
+            for document, count in zip(self.corpus, counts.tolist()):
+                for _ in range(count):
+                    yield document
+
+
+class CorpusStore:
+    """A corpus encoded as integers, which takes a fraction of the memory that lists of strings need.
+
+    The corpus consists of a vocab, a flat array of uint32 token ids, and the offsets at which each sentence starts
+    in the token array. It is saved as a directory that contains the files 'vocab.txt' (one word per line),
+    'tokens.bin' (little-endian uint32) and 'offsets.bin' (little-endian int64, one more entry than there are
+    sentences). Loading memory-maps the two arrays, so it costs no copy and processes share them.
+
+    Iterating yields the sentences as lists of words, so a store can be used wherever a list of token lists was used.
+    """
+
+    VOCAB_FILE = "vocab.txt"
+    TOKENS_FILE = "tokens.bin"
+    OFFSETS_FILE = "offsets.bin"
+
+    def __init__(self, vocab, tokens, offsets, path=None):
+        """
+        Args:
+            vocab (list[str]): the words, the position of a word in this list is its id
+            tokens (ndarray): token ids of all sentences, concatenated
+            offsets (ndarray): sentence i consists of tokens[offsets[i]:offsets[i+1]]
+            path (str): directory the store was loaded from, if any
+        """
+        self.vocab = list(vocab)
+        self.word_index = {word: idx for idx, word in enumerate(self.vocab)}
+        self.tokens = tokens
+        self.offsets = offsets
+        self.path = path
+
+    @staticmethod
+    def is_store(path):
+        """Return whether 'path' is a directory that contains a corpus store."""
+        return os.path.isfile(os.path.join(path, CorpusStore.VOCAB_FILE))
+
+    @classmethod
+    def write(cls, path, sentences):
+        """Encode the sentences and write them to a new store in the directory 'path', without holding the
+        encoded corpus in memory. Returns the (memory-mapped) store.
+
+        Args:
+            path (str): directory of the store
+            sentences (iterable): iterable of token lists
+        """
+        os.makedirs(path, exist_ok=True)
+
+        # an index of a corpus that was written here before does not fit the new one
+        for filename in [ContextIndex.POSITIONS_FILE, ContextIndex.STARTS_FILE]:
+            if os.path.isfile(os.path.join(path, filename)):
+                os.remove(os.path.join(path, filename))
+
+        word_index = {}
+        offsets = array("q", [0])
+        buffer = array("I")
+        n_tokens = 0
+        with open(os.path.join(path, cls.TOKENS_FILE), "wb") as f:
+            for ids in _encode(sentences, word_index):
+                buffer.extend(ids)
+                n_tokens += len(ids)
+                offsets.append(n_tokens)
+
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    np.asarray(buffer, dtype="<u4").tofile(f)
+                    buffer = array("I")
+            np.asarray(buffer, dtype="<u4").tofile(f)
+
+        np.asarray(offsets, dtype="<i8").tofile(os.path.join(path, cls.OFFSETS_FILE))
+        with open(os.path.join(path, cls.VOCAB_FILE), "w", encoding="utf8") as f:
+            for word in word_index:
+                f.write("%s\n" % word)
+
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load the store in the directory 'path'.
+
+        Args:
+            path (str): directory of the store
+            mmap (bool): if True, memory-map the token ids and offsets read-only instead of reading them
+        """
+        with open(os.path.join(path, cls.VOCAB_FILE), "r", encoding="utf8") as f:
+            vocab = [line.rstrip("\n") for line in f]
+
+        tokens = _read_array(os.path.join(path, cls.TOKENS_FILE), "<u4", mmap)
+        offsets = _read_array(os.path.join(path, cls.OFFSETS_FILE), "<i8", mmap)
+        return cls(vocab, tokens, offsets, path=path)
+
+    @classmethod
+    def from_sentences(cls, sentences):
+        """Encode the sentences into a store that is held in memory.
+
+        Args:
+            sentences (iterable): iterable of token lists
+        """
+        word_index = {}
+        offsets = array("q", [0])
+        tokens = array("I")
+        for ids in _encode(sentences, word_index):
+            tokens.extend(ids)
+            offsets.append(len(tokens))
+
+        return cls(list(word_index), np.asarray(tokens, dtype=np.uint32), np.asarray(offsets, dtype=np.int64))
+
+    @classmethod
+    def from_text_file(cls, path):
+        """Encode a text file in "one-sentence-per-line" format into a store that is held in memory."""
+        return cls.from_sentences(LineSentenceCorpus(path))
+
+    def __getstate__(self):
+        # a store on disk is sent to other processes by its path, not by copying the arrays
+        if self.path is not None:
+            return {"path": self.path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if list(state) == ["path"]:
+            state = CorpusStore.load(state["path"]).__dict__
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def n_tokens(self):
+        """Return the number of tokens in the corpus."""
+        return len(self.tokens)
+
+    def frequencies(self):
+        """Return an array that holds the number of occurrences of each word in the vocab, computed in one pass."""
+        return np.bincount(self.tokens, minlength=len(self.vocab))
+
+    def sentence_ids(self, idx):
+        """Return the token ids of sentence 'idx'."""
+        return self.tokens[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __getitem__(self, idx):
+        vocab = self.vocab
+        return [vocab[i] for i in self.sentence_ids(idx).tolist()]
+
+    def __iter__(self):
+        vocab = self.vocab
+        for idx in range(len(self)):
+            yield [vocab[i] for i in self.sentence_ids(idx).tolist()]
+
+
+class ContextIndex:
+    """An inverted index from the words of a CorpusStore to the positions at which they occur in its token array.
+
+    The positions of word i are positions[starts[i]:starts[i+1]], in increasing order. The index is saved as the
+    files 'index-positions.npy' and 'index-starts.npy', by default in the directory of the store, and memory-mapped
+    on loading.
+    """
+
+    POSITIONS_FILE = "index-positions.npy"
+    STARTS_FILE = "index-starts.npy"
+
+    def __init__(self, positions, starts):
+        """
+        Args:
+            positions (ndarray): token positions, grouped by word id
+            starts (ndarray): start of the positions of each word id in 'positions', plus the total length
+        """
+        self.positions = positions
+        self.starts = starts
+
+    @classmethod
+    def build(cls, store):
+        """Build the index of 'store' with one stable sort of its token ids."""
+        dtype = np.uint32 if store.n_tokens() < 2**32 else np.int64
+        positions = np.argsort(store.tokens, kind="stable").astype(dtype)
+        starts = np.zeros(len(store.vocab) + 1, dtype=np.int64)
+        np.cumsum(store.frequencies(), out=starts[1:])
+        return cls(positions, starts)
+
+    def fits(self, store):
+        """Return whether the index has the vocab size and number of tokens of 'store', which an index built from
+        another corpus almost never has."""
+        return len(self.starts) == len(store.vocab) + 1 and int(self.starts[-1]) == store.n_tokens()
+
+    @staticmethod
+    def exists(path):
+        """Return whether an index was saved in the directory 'path'."""
+        return os.path.isfile(os.path.join(path, ContextIndex.POSITIONS_FILE))
+
+    def save(self, path):
+        """Save the index in the directory 'path'."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, self.POSITIONS_FILE), self.positions)
+        np.save(os.path.join(path, self.STARTS_FILE), self.starts)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load the index saved in the directory 'path', memory-mapped if 'mmap' is True."""
+        mmap_mode = "r" if mmap else None
+        return cls(np.load(os.path.join(path, cls.POSITIONS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, cls.STARTS_FILE), mmap_mode=mmap_mode))
+
+    def positions_of(self, word_id):
+        """Return the positions of the word with id 'word_id' in the token array."""
+        return self.positions[self.starts[word_id]:self.starts[word_id + 1]]
+
+
+def _encode(sentences, word_index):
+    """Yield the token ids of each sentence as an array, adding new words to 'word_index'."""
+    for sentence in sentences:
+        ids = array("I")
+        for word in sentence:
+            idx = word_index.get(word)
+            if idx is None:
+                idx = word_index[word] = len(word_index)
+            ids.append(idx)
+        yield ids
+
+
+def _read_array(path, dtype, mmap):
+    """Read a raw binary array, memory-mapped if 'mmap' is True. Empty files cannot be mapped and are read."""
+    if mmap and os.path.getsize(path) > 0:
+        return np.memmap(path, dtype=dtype, mode="r")
+    return np.fromfile(path, dtype=dtype)
@@ -1,80 +1,115 @@
 # This file contains a class for data loading and analysing
 # MMA data provided as json files
+import os
+import tempfile
 import pandas as pd
-import json
-from nltk.corpus import stopwords
 import matplotlib.pyplot as plt
-import nltk
 import gensim
-import string
-from bs4 import BeautifulSoup
-import re
 from itertools import groupby
+from mma_word_embeddings.corpus import CorpusStore, LineSentenceCorpus
+from mma_word_embeddings.reader import read_records
+from mma_word_embeddings.checkpoint import PreprocessingCheckpoint
+from mma_word_embeddings.preprocessing import clean_documents, print_progress, stop, CUSTOM_STOPWORDS, \
+    STOPWORD_EXCEPTIONS, PUNCTUATION, GARBAGE
 
-
-nltk.download('stopwords')
-nltk.download('wordnet')
-stop = stopwords.words('english')
-
-CUSTOM_STOPWORDS = []
-STOPWORD_EXCEPTIONS = ['he', 'she', 'him', 'her', 'his', 'hers']
-PUNCTUATION = string.punctuation + "“”’‘‚…"  # add some symbols that have different ascii
-GARBAGE = ['windowtextcolor', ]
+# file in the checkpoint directory that holds the training data after phrasing
+TRAINING_DATA_FILE = "training-data.txt"
 
 
 class DexterData:
 
-    def __init__(self, path_to_data):
+    def __init__(self, path_to_data, columns=None, filters=None, stream=False):
         """Representation of the data.
+
+        The file is read record by record, so that only the selected columns of the records that pass the filters
+        are ever held in memory. With 'stream' set to True, no data frame is built at all; the file is read anew
+        whenever the documents are needed, and only the methods that process documents are available.
+
         Args:
-            path_to_data (str): path to .json data file
+            path_to_data (str): path to .json data file, which holds a json array or json lines
+            columns (list[str]): columns to load; all columns are loaded if None
+            filters (dict): maps a column to a list of selectors; only rows with any of the selectors as value
+                for the column are kept, like filter()
+            stream (bool): if True, do not load the data into a data frame
         """
 
-        print("Loading data...")
-        with open(path_to_data, 'r', encoding='utf8') as f:
-            data = json.load(f)
-        print("...done.")
-
-        self.data = pd.DataFrame(data)
         self.data_path = path_to_data
+        self.columns = columns
+        self.filters = []
+        self.stream = stream
         self.training_data = None
+        self.phrasers = None
+        self.cleaning_stats = None
         self.description = "Data was loaded from file {}. \n".format(path_to_data)
 
+        if stream:
+            self.data = None
+        else:
+            print("Loading data...")
+            self.data = pd.DataFrame(list(read_records(path_to_data, columns=columns, filters=filters)),
+                                     columns=columns)
+            print("...done.")
+
+        for column, selectors in (filters or {}).items():
+            self._describe_filter(column, selectors)
+            self.filters.append((column, selectors))
+
+    def _frame(self):
+        """Return the data frame, or raise an error if the data is streamed."""
+        if self.data is None:
+            raise ValueError("The data was opened with stream=True and is not held in a data frame.")
+        return self.data
+
     def head(self):
         """print head of data frame."""
-        return self.data.head()
+        return self._frame().head()
 
     def first_entry(self, column):
         """return first entry of the column."""
-        return self.data[column].iloc[0]
+        return self._frame()[column].iloc[0]
 
     def column_names(self):
         """Return list of column names."""
 
-        return list(self.data)
+        return list(self._frame())
 
     def column(self, column):
         """Return 'column' as a list."""
 
-        return self.data[column].to_list()
+        return self._frame()[column].to_list()
 
     def unique_values(self, column):
         """Return list of unique values represented in the column."""
 
-        return self.data[column].value_counts()
+        return self._frame()[column].value_counts()
+
+    def documents(self, column):
+        """Return the entries of 'column'. If the data is streamed, return a generator that reads them from the
+        file, applying the filters while reading."""
+
+        if self.stream:
+            return (record[column] for record in read_records(self.data_path, columns=[column],
+                                                              filters=self.filters))
+        return self.column(column)
 
     def filter(self, column, selectors):
         """Only keep rows with any of 'selectors' as value for 'column'."""
 
-        mask = self.data[column].str.contains('|'.join(selectors))
-        self.data = self.data[mask]
+        # streamed data is filtered while it is read
+        if not self.stream:
+            mask = self.data[column].str.contains('|'.join(selectors))
+            self.data = self.data[mask]
+        self.filters.append((column, selectors))
+        self._describe_filter(column, selectors)
+
+    def _describe_filter(self, column, selectors):
         self.description += "The data was filtered, keeping only rows where column <{}> contains (at least one of) the " \
                             "expression(s) {}. \n".format(column, selectors)
 
     def plot_historgram(self, column, selectors, x_axis, bins=20):
         fig, ax = plt.subplots()
         for selector in selectors:
-            df = self.data[self.data[column] == selector][x_axis]
+            df = self._frame()[self.data[column] == selector][x_axis]
             plt.hist(df, bins=bins, alpha=0.5, label=selector)
 
         num_x_ticks = len(ax.xaxis.get_ticklabels())
@@ -88,7 +123,8 @@ class DexterData:
         plt.show()
 
     def get_training_data(self, text_column, min_count_ngrams=50, threshold_ngrams=10,
-                          remove_stopwords=False, lemmatize=False):
+                          remove_stopwords=False, lemmatize=False, n_jobs=1, progress=print_progress,
+                          checkpoint_dir=None, phrasers=None):
         """Get a representation of the data that can be used to train a word2vec model.
 
         Args:
@@ -99,6 +135,20 @@ class DexterData:
                 Heavily depends on concrete scoring-function, see the scoring parameter.
             remove_stopwords (bool): If true, remove standard stop words from training data.
             lemmatize (bool): If true, replace words by their stems
+            n_jobs (int): number of processes that clean the sentences in parallel
+            progress (callable): called as progress(n_done, n_total) with the number of cleaned documents
+                after every chunk of documents; None to stay quiet
+            checkpoint_dir (str): if given, write every chunk of cleaned documents to this directory as soon as it
+                is done. Calling this method again with the same directory skips the documents that were already
+                cleaned, so that a run that was killed resumes, and documents appended to the source since the
+                last run are the only ones that get cleaned. The bigram model is saved there too and updated with
+                the new sentences only; the trigram model is fitted anew on all sentences. If not given, the
+                cleaned documents are written to a temporary directory.
+            phrasers (tuple or str): bigram and trigram Phraser to apply instead of learning them, or the path
+                prefix they were saved under with save_phrasers()
+
+        Returns:
+            LineSentenceCorpus: the non-empty training sentences, streamed from disk
         """
 
         print("Process data...")
@@ -121,79 +171,112 @@ class DexterData:
         if lemmatize:
             self.description += r"...lemmatize words with nltk's WordNetLemmatizer, " + "\n"
 
-        # create list of word lists per document (i.e., newspaper article, utterance)
-        cleaned_data = []
-        corpus = self.data[text_column].to_list()
-
-        corpus = [document.split(".") for document in corpus]
-        sentences = [sentence for document in corpus for sentence in document]
-
-        for idx, sentence in enumerate(sentences):
-
-                if idx % 10000 == 0:
-                    print("...cleaned first ", idx, " sentences...")
-
-                sentence = re.sub(r'\b[a-z]+(?:[A-Z][a-z]+)+\b', '', sentence)
-
-                sentence = BeautifulSoup(sentence, "html.parser").text
+        # create list of word lists per sentence of each document (i.e., newspaper article, utterance);
+        # streamed documents are pulled from the file chunk by chunk
+        corpus = self.documents(text_column)
+
+        # the cleaned sentences are kept on disk, so that the phrases can be learned and applied in streaming passes;
+        # without a checkpoint directory they go to a temporary directory, which lives as long as the returned corpus
+        work_dir = None
+        if checkpoint_dir is None:
+            work_dir = tempfile.TemporaryDirectory()
+            checkpoint_dir = work_dir.name
+        settings = {"source": self.data_path, "text_column": text_column, "filters": self.filters,
+                    "remove_stopwords": remove_stopwords, "lemmatize": lemmatize,
+                    "min_count_ngrams": min_count_ngrams, "threshold_ngrams": threshold_ngrams}
+        checkpoint = PreprocessingCheckpoint(checkpoint_dir, settings)
+        if checkpoint.n_documents > 0:
+            print("...resume after the {} documents cleaned before...".format(checkpoint.n_documents))
+        _, self.cleaning_stats = clean_documents(corpus, remove_stopwords=remove_stopwords, lemmatize=lemmatize,
+                                                 n_jobs=n_jobs, progress=progress, skip=checkpoint.n_documents,
+                                                 sink=checkpoint.add_chunk)
+        print("...cleaned {} sentences in {:.1f}s ({:.0f} sentences per second).".format(
+            self.cleaning_stats["sentences"], self.cleaning_stats["seconds"],
+            self.cleaning_stats["sentences_per_second"]))
 
-                sentence = sentence.replace(r'\xad', '')
-
-                sentence = sentence.replace('displayad', '')
-
-                sentence = ''.join(char for word in sentence for char in word
-                                   if char not in PUNCTUATION and not char.isdigit())
-
-                # split string into list of words separated by whitespace
-                sentence = sentence.split()
-
-                sentence = [word for word in sentence if all(g not in word for g in GARBAGE)]
-
-                if remove_stopwords:
-                    sentence = [word for word in sentence if word not in stop or word in STOPWORD_EXCEPTIONS]
-
-                sentence = [word.lower() for word in sentence]
+        # SECOND STEP: make N-Grams #########################
+        print("...make bigrams and trigrams...")
 
-                if lemmatize:
-                    lm = nltk.WordNetLemmatizer()
-                    sentence = [lm.lemmatize(word) for word in sentence]
+        if phrasers is None:
+            # save description
+            self.description += "...turn common word sequences into bigrams or trigrams using gensim " \
+                                "(min_count {} and threshold {})".format(min_count_ngrams, threshold_ngrams)
+
+            # first pass learns the bigrams, second pass the trigrams over the bigrammed sentences
+            bigram = checkpoint.bigram(min_count=min_count_ngrams, threshold=threshold_ngrams)
+            bigram_mod = gensim.models.phrases.Phraser(bigram)
+            trigram = gensim.models.Phrases(bigram_mod[checkpoint], min_count=min_count_ngrams,
+                                            threshold=threshold_ngrams)
+            trigram_mod = gensim.models.phrases.Phraser(trigram)
+        else:
+            if isinstance(phrasers, str):
+                self.description += "...turn common word sequences into bigrams or trigrams using the gensim " \
+                                    "phrasers saved under {}\n".format(phrasers)
+                phrasers = self.load_phrasers(phrasers)
+            else:
+                self.description += "...turn common word sequences into bigrams or trigrams using given gensim " \
+                                    "phrasers\n"
+            bigram_mod, trigram_mod = phrasers
+
+        self.phrasers = (bigram_mod, trigram_mod)
+
+        # third pass applies the phrases and writes the non-empty sentences to disk
+        path = os.path.join(checkpoint.path, TRAINING_DATA_FILE)
+        with open(path + ".tmp", 'w') as f:
+            for sentence in trigram_mod[bigram_mod[checkpoint]]:
+                if sentence:
+                    f.write('%s\n' % " ".join(sentence))
+        os.replace(path + ".tmp", path)
 
-                cleaned_data.append(sentence)
+        print("...done.")
 
-        # SECOND STEP: make N-Grams #########################
-        print("...make bigrams and trigrams...")
+        ##########################
 
-        # save description
-        self.description += "...turn common word sequences into bigrams or trigrams using gensim " \
-                            "(min_count {} and threshold {})".format(min_count_ngrams, threshold_ngrams)
+        self.training_data = LineSentenceCorpus(path, work_dir=work_dir)
 
-        bigram = gensim.models.Phrases(cleaned_data, min_count=min_count_ngrams, threshold=threshold_ngrams)
-        trigram = gensim.models.Phrases(bigram[cleaned_data], min_count=min_count_ngrams, threshold=threshold_ngrams)
+        return self.training_data
 
-        bigram_mod = gensim.models.phrases.Phraser(bigram)
-        trigram_mod = gensim.models.phrases.Phraser(trigram)
+    def save_phrasers(self, output_path):
+        """Save the bigram and trigram Phraser of get_training_data() as <output_path>-bigram.phraser and
+        <output_path>-trigram.phraser, so that the same phrases can be applied to new data."""
 
-        cleaned_data = [trigram_mod[bigram_mod[document]] for document in cleaned_data]
+        if self.phrasers is None:
+            raise ValueError("You need to run the get_training_data() method before saving the phrasers.")
 
-        print("...done.")
+        bigram_mod, trigram_mod = self.phrasers
+        bigram_mod.save(output_path + '-bigram.phraser')
+        trigram_mod.save(output_path + '-trigram.phraser')
 
-        ##########################
+    @staticmethod
+    def load_phrasers(output_path):
+        """Load the bigram and trigram Phraser saved by save_phrasers() under the path prefix 'output_path'."""
 
-        self.training_data = [sentence for sentence in cleaned_data if sentence != []]
+        return (gensim.models.phrases.Phraser.load(output_path + '-bigram.phraser'),
+                gensim.models.phrases.Phraser.load(output_path + '-trigram.phraser'))
 
-        return cleaned_data
+    def save_training_data(self, output_path, binary=False):
+        """Save the training data in "one-sentence-per-line" format.
 
-    def save_training_data(self, output_path):
-        """Save the training data in "one-sentence-per-line" format."""
+        Args:
+            output_path (str): path prefix of the output files
+            binary (bool): if True, save the training data as an integer-encoded CorpusStore in the directory
+                <output_path>-training-data.corpus instead of a text file
+        """
 
         if self.training_data is None:
             raise ValueError("You need to run the get_training_data() method before saving the data.")
 
         # Save training data
-        with open(output_path + '-training-data.txt', 'w') as f:
-            for document in self.training_data:
-                sentence = " ".join(word for word in document)
-                f.write('%s\n' % sentence)
+        if binary:
+            CorpusStore.write(output_path + '-training-data.corpus', self.training_data)
+        else:
+            with open(output_path + '-training-data.txt', 'w') as f:
+                for document in self.training_data:
+                    sentence = " ".join(word for word in document)
+                    f.write('%s\n' % sentence)
+
+        # Save phrasers
+        self.save_phrasers(output_path)
 
         # Save description
         with open(output_path + '-description.txt', 'w') as f:
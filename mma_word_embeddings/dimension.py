@@ -0,0 +1,221 @@
+# This file contains classes that represent dimensions in the embedding space, which are generated by
+# clusters of words, and caches their vectors per embedding
+from collections import OrderedDict
+import numpy as np
+from mma_word_embeddings.utils import normalize_vector, normalize_matrix
+
+# maximum number of dimension vectors that are cached per embedding
+CACHE_SIZE = 256
+
+
+def cached(obj, key, compute):
+    """Return the value cached under 'key' on 'obj', computing it with 'compute()' if necessary.
+
+    Every object has its own least-recently-used cache of at most CACHE_SIZE entries, so that the identity of the
+    embedding is part of the key without having to keep track of object ids.
+    """
+    cache = obj.__dict__.setdefault("_dimension_cache", OrderedDict())
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    value = compute()
+    cache[key] = value
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+
+class Dimension:
+    """A direction in the embedding space. A unipolar dimension is generated by the centroid of one cluster of words,
+    a bipolar dimension by the difference of the centroids of two clusters of words."""
+
+    def __init__(self, name, generating_words, bipolar):
+        """
+        Args:
+            name (str): name of the dimension like 'gender (male-female)'
+            generating_words (list): list of words like ['man', 'he',...] for a unipolar dimension, or list of two
+                clusters like [['man', 'he',...], ['girl', 'her',...]] for a bipolar dimension
+            bipolar (bool): whether the dimension is bipolar
+        """
+
+        if bipolar:
+            if len(generating_words) != 2:
+                raise ValueError("Generating words must be a list of exactly two lists that contain words.")
+            clusters = tuple(tuple(cluster) for cluster in generating_words)
+        else:
+            if len(np.array(generating_words).shape) != 1:
+                raise ValueError("Generating words must be a list of words.")
+            clusters = (tuple(generating_words),)
+
+        self.name = name
+        self.bipolar = bipolar
+        self.clusters = clusters
+
+    def __repr__(self):
+        return "<Dimension {} ({})>".format(self.name, "bipolar" if self.bipolar else "unipolar")
+
+    def key(self, normalize_before, normalize_centroids):
+        """Return the cache key of this dimension: the generating words and normalisation flags."""
+        if not self.bipolar:
+            normalize_centroids = None
+        return self.bipolar, self.clusters, bool(normalize_before), normalize_centroids
+
+    def vector(self, embedding, normalize_before=None, normalize_centroids=True):
+        """Return the vector of this dimension in 'embedding'.
+
+        Args:
+            embedding (WordEmbedding): embedding in which to construct the dimension
+            normalize_before (bool): normalise the dimension vector; defaults to True for unipolar and
+                False for bipolar dimensions
+            normalize_centroids (bool): normalise the two cluster centroids of a bipolar dimension before
+                taking their difference
+
+        Returns:
+            ndarray
+        """
+        if normalize_before is None:
+            normalize_before = not self.bipolar
+
+        def compute():
+            if self.bipolar:
+                centroid_left_cluster = embedding.centroid_of_vectors(self.clusters[0], normalize=normalize_centroids)
+                centroid_right_cluster = embedding.centroid_of_vectors(self.clusters[1], normalize=normalize_centroids)
+                vec = centroid_left_cluster - centroid_right_cluster
+            else:
+                vec = embedding.centroid_of_vectors(self.clusters[0])
+
+            if normalize_before:
+                vec = normalize_vector(vec)
+            vec = np.asarray(vec, dtype=np.float32)
+            vec.flags.writeable = False
+            return vec
+
+        return cached(embedding, self.key(normalize_before, normalize_centroids), compute)
+
+    def stacked_vector(self, ensemble, normalize_before=None, normalize_centroids=False):
+        """Return the vectors of this dimension in all members of 'ensemble' at once.
+
+        Generating words that are missing from a member are left out of that member's centroids. A member in
+        which a cluster has none of its words cannot represent the dimension and is marked as invalid.
+
+        Args:
+            ensemble (EmbeddingEnsemble): ensemble in which to construct the dimension
+            normalize_before (bool): see vector()
+            normalize_centroids (bool): see vector()
+
+        Returns:
+            ndarray of shape (n_members, dim), ndarray of shape (n_members,) that is True for valid members
+        """
+        if normalize_before is None:
+            normalize_before = not self.bipolar
+
+        def compute():
+            sides = ["left ", "right "] if self.bipolar else [""]
+            valid = np.ones(len(ensemble.list_of_embeddings), dtype=bool)
+            centroids = []
+            for side, cluster in zip(sides, self.clusters):
+
+                vecs, mask = ensemble.stacked_vectors(cluster)
+                counts = mask.sum(axis=1)
+                valid &= counts > 0
+
+                for idx in range(len(mask)):
+                    if counts[idx] == 0:
+                        print("INFO: None of the {}generating words to construct dimension {} found in embedding "
+                              "no {}; this embedding is not used to compute the ensemble projection for "
+                              "this dimension.".format(side, self.name, idx))
+                    elif counts[idx] < len(cluster):
+                        missing = [word for word, found in zip(cluster, mask[idx]) if not found]
+                        print("INFO: {} word(s) {} not found in vocab of embedding no {}; "
+                              "word(s) will not be used to construct the dimension in this "
+                              "embedding.".format((side + "generating").capitalize(), missing, idx))
+
+                centroid = vecs.sum(axis=1) / np.maximum(counts, 1)[:, np.newaxis]
+                if self.bipolar and normalize_centroids:
+                    centroid = normalize_matrix(centroid)
+                centroids.append(centroid)
+
+            vec = centroids[0] - centroids[1] if self.bipolar else centroids[0]
+            if normalize_before:
+                vec = normalize_matrix(vec)
+            vec = np.ascontiguousarray(vec, dtype=np.float32)
+            vec.flags.writeable = False
+            valid.flags.writeable = False
+            return vec, valid
+
+        key = ("stacked",) + self.key(normalize_before, normalize_centroids)
+        return cached(ensemble, key, compute)
+
+
+class DimensionSet:
+    """An ordered collection of dimensions, which compiles into a basis matrix for projections."""
+
+    def __init__(self, dimensions):
+        """
+        Args:
+            dimensions (list[Dimension]): the dimensions in this set
+        """
+        self.dimensions = list(dimensions)
+
+    @classmethod
+    def from_dict(cls, dimensions, bipolar):
+        """Make a dimension set from a dictionary like
+
+                    {'gender (male-female)': [['man', 'he',...], ['girl', 'her',...]],
+                     'race (black-white)': [['black', ...], ['white', ...]],
+                     ...
+                     }
+
+        for bipolar dimensions, or like {'male': ['man', 'he',...], ...} for unipolar dimensions.
+        """
+        return cls([Dimension(name, generating_words, bipolar) for name, generating_words in dimensions.items()])
+
+    @classmethod
+    def make(cls, dimensions, bipolar):
+        """Return 'dimensions' as a DimensionSet. 'dimensions' can be a dictionary in the format accepted by
+        from_dict(), or a DimensionSet."""
+        if isinstance(dimensions, DimensionSet):
+            if any(dim.bipolar != bipolar for dim in dimensions):
+                raise ValueError("Expected only {} dimensions.".format("bipolar" if bipolar else "unipolar"))
+            return dimensions
+        return cls.from_dict(dimensions, bipolar)
+
+    def __len__(self):
+        return len(self.dimensions)
+
+    def __iter__(self):
+        return iter(self.dimensions)
+
+    def names(self):
+        """Return the names of the dimensions."""
+        return [dim.name for dim in self.dimensions]
+
+    def basis(self, embedding, normalize_before=None, normalize_centroids=True):
+        """Return an array of shape (n_dimensions, dim) whose rows are the dimension vectors in 'embedding'.
+
+        The vectors are cached per embedding, so repeated queries with the same generating words
+        skip the centroid computation. See Dimension.vector() for the arguments.
+        """
+        dim = embedding.vectors([]).shape[1]
+        vecs = [d.vector(embedding, normalize_before=normalize_before, normalize_centroids=normalize_centroids)
+                for d in self.dimensions]
+        return np.array(vecs, dtype=np.float32).reshape(len(vecs), dim)
+
+    def stacked_basis(self, ensemble, normalize_before=None, normalize_centroids=False):
+        """Return the basis of this set in all members of 'ensemble' at once, as an array of shape
+        (n_members, n_dimensions, dim), together with a boolean array of shape (n_members, n_dimensions) that
+        marks which members can represent which dimension. See Dimension.stacked_vector() for the arguments.
+        """
+        n_members, _, dim = ensemble.stacked_vectors([])[0].shape
+        vecs = []
+        valid = []
+        for d in self.dimensions:
+            vec, val = d.stacked_vector(ensemble, normalize_before=normalize_before,
+                                        normalize_centroids=normalize_centroids)
+            vecs.append(vec)
+            valid.append(val)
+
+        if not self.dimensions:
+            return np.zeros((n_members, 0, dim), dtype=np.float32), np.zeros((n_members, 0), dtype=bool)
+        return np.stack(vecs, axis=1), np.stack(valid, axis=1)
@@ -1,8 +1,13 @@
 # This file contains a wrapper class that represents word trained embeddings
 from gensim.models import KeyedVectors
-from mma_word_embeddings.utils import normalize_vector, make_pairs, kl_divergence, mmd2
+from mma_word_embeddings.utils import normalize_vector, normalize_matrix, make_pairs, kl_divergence, mmd2, \
+    describe_resident_memory
+from mma_word_embeddings.dimension import DimensionSet
+from mma_word_embeddings.corpus import CorpusStore, ContextIndex
+from mma_word_embeddings.neighbours import query_vector, top_k, select_candidates, merge_candidates, IVFIndex, \
+    vocab_fingerprint, N_PROBE, MAX_CHUNK_ELEMENTS
 import numpy as np
-from itertools import combinations_with_replacement, combinations, product
+from itertools import combinations
 import pandas as pd
 from sklearn.decomposition import PCA
 import matplotlib.pyplot as plt
@@ -11,6 +16,9 @@ from sklearn.manifold import TSNE
 from collections import Counter
 from random import sample
 import glob
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import seaborn as sns
 import networkx as nx
 import matplotlib.cm as cm
@@ -25,6 +33,9 @@ pd.options.display.float_format = '{:,.4f}'.format
 
 COLORMAP = mcolors.LinearSegmentedColormap.from_list("MyCmapName", ["r", "w", "g"])
 
+# number of rows inspected to decide whether a memory-mapped matrix is already normalized
+MMAP_CHECK_ROWS = 1000
+
 
 class EmbeddingError(Exception):
     """Exception raised by a Model object when something is wrong.
@@ -34,25 +45,50 @@ class EmbeddingError(Exception):
 class WordEmbedding:
     """Representation of a word embedding, which is a map from word strings to vectors."""
 
-    def __init__(self, path_to_embedding, path_training_data=None):
+    def __init__(self, path_to_embedding, path_training_data=None, mmap=False):
+        """
+        Args:
+            path_to_embedding (str): path to the .emb file
+            path_training_data (str): path to the training data, optional
+            mmap (bool): if True, map the vector matrix read-only into memory instead of loading it, so that
+                several processes using the same embedding share it through the OS page cache. This only has
+                an effect for matrices that gensim saved into a separate .npy file next to the .emb file
+                (which it does for arrays larger than 10MB).
+        """
 
         print("Loading embedding {} ... ".format(path_to_embedding))
 
         try:
             # load the word vectors of an embedding
-            self._word_vectors = KeyedVectors.load(path_to_embedding)
+            self._word_vectors = KeyedVectors.load(path_to_embedding, mmap='r' if mmap else None)
         except:
             raise EmbeddingError("Failed to load the embedding. In 99.999% of all cases this means your "
                                  "path is wrong. Good luck.")
+        self.mmap = mmap
+
+        # map each word to its row in the vector matrix, so that lookups do not scan the vocab
+        self._index = {word: idx for idx, word in enumerate(self._word_vectors.index2word)}
+
+        # cache the unit-normalized vectors as one contiguous float32 matrix; all lookups are served from here
+        check_rows = MMAP_CHECK_ROWS if mmap else None
+        self._matrix = normalize_matrix(self._word_vectors.vectors, check_rows=check_rows).view()
+        self._matrix.flags.writeable = False
+        if mmap and not np.may_share_memory(self._matrix, self._word_vectors.vectors):
+            print("INFO: The vectors of embedding {} are not normalized and had to be copied into memory, "
+                  "so they are not shared between processes.".format(path_to_embedding))
 
         self.description = "This object represents the {} word embedding.".format(path_to_embedding)
         self.path_to_embedding = path_to_embedding.replace("/content/drive/My Drive/", "")
+        self._embedding_file = path_to_embedding
 
         self.training_data = None
+        self._frequencies = None
+        self._context_index = None
+        self._ann_index = None
         if path_training_data is not None:
             self.load_training_data(path_training_data)
 
-        print("...finished loading.")
+        print("...finished loading ({}).".format(describe_resident_memory()))
 
     def __str__(self):
         return "<Embedding {}>".format(self.path_to_embedding)
@@ -69,23 +105,34 @@ class WordEmbedding:
                 if word.count("_") == n_grams - 1:
                     voc.append(word)
         else:
-            voc = list(self._word_vectors.vocab)
+            voc = list(self._index)
 
         return sorted(voc)
 
     def vocab_size(self):
         """Return the size of the vocabulary in the embedding."""
 
-        return len(list(self._word_vectors.vocab))
+        return len(self._index)
 
     def in_vocab(self, word):
         """Return whether word is in vocab."""
-        return word in list(self._word_vectors.vocab)
+        return word in self._index
+
+    def in_vocab_many(self, list_of_words):
+        """Return a boolean mask that is True for each word in 'list_of_words' found in the vocab."""
+        return np.array([word in self._index for word in list_of_words], dtype=bool)
+
+    def _row(self, word):
+        """Return the row of 'word' in the vector matrix."""
+        try:
+            return self._index[word]
+        except KeyError:
+            raise KeyError("word '{}' not in vocabulary".format(word))
 
     def random_words(self, n_words=100, min_frequency=None):
         """Return a list of random words from the vocab of this embedding.
 
-        If the training data is loaded, the minimum frequency can be specified.
+        If the training data or a frequency table is loaded, the minimum frequency can be specified.
 
         Args:
             n_words (int): number of random words to select
@@ -95,11 +142,6 @@ class WordEmbedding:
             list(str): random words
         """
 
-        if min_frequency is not None and self.training_data is None:
-            raise ValueError("This function needs access to the training data. "
-                             "Please load the training data with the 'load_training_data()' "
-                             "function and then try again. ")
-
         if min_frequency is not None:
             vocab = self.vocab_sorted_by_frequency_in_training_data(more_frequent_than=min_frequency)
             vocab = vocab['Word'].tolist()
@@ -109,54 +151,159 @@ class WordEmbedding:
         return sample(vocab, n_words)
 
     def load_training_data(self, path_training_data):
-        """Load training data into embedding after embedding was created."""
-        training_data = []
+        """Load training data into embedding after embedding was created.
+
+        The path can point to a text file in "one-sentence-per-line" format, which is encoded into a compact
+        CorpusStore in memory, or to the directory of a CorpusStore, which is memory-mapped.
+        """
         if path_training_data is not None:
-            with open(path_training_data, "r") as f:
-                for line in f:
-                    stripped_line = line.strip()
-                    line_list = stripped_line.split()
-                    training_data.append(line_list)
-            self.training_data = training_data
-
-    def context_in_training_data(self, word, n=3):
-        """Return whether word is in vocab. Only works if training data was loaded.
+            if CorpusStore.is_store(path_training_data):
+                self.training_data = CorpusStore.load(path_training_data)
+            else:
+                self.training_data = CorpusStore.from_text_file(path_training_data)
+            self._frequencies = None
+            self._context_index = None
+
+    def frequency_table(self):
+        """Return a Counter with the frequency of each word in the training data.
+
+        The table is computed in a single pass over the training data on first use and cached. It can be saved
+        next to the embedding with save_frequency_table() and loaded with load_frequency_table(), after
+        which the frequency methods work without the training data.
+        """
+        if self._frequencies is None:
+            if self.training_data is None:
+                raise ValueError("This function needs access to the training data. "
+                                 "Please load the training data with the 'load_training_data()' "
+                                 "function and then try again. ")
+
+            counts = self.training_data.frequencies()
+            self._frequencies = Counter(dict(zip(self.training_data.vocab, counts.tolist())))
+        return self._frequencies
+
+    def save_frequency_table(self, path=None):
+        """Save the frequency table as tab-separated "word frequency" lines, most frequent words first.
+
         Args:
-            word (str): Word to search for
-            n (int): number of neighbouring words to print
+            path (str): output file, defaults to the path of the embedding with extension .freq
+        """
+        if path is None:
+            path = self._embedding_file + ".freq"
+
+        with open(path, "w", encoding="utf8") as f:
+            for word, frequency in self.frequency_table().most_common():
+                f.write("%s\t%d\n" % (word, frequency))
+
+    def load_frequency_table(self, path=None):
+        """Load a frequency table saved with save_frequency_table().
+
+        Args:
+            path (str): input file, defaults to the path of the embedding with extension .freq
+        """
+        if path is None:
+            path = self._embedding_file + ".freq"
+
+        frequencies = Counter()
+        with open(path, "r", encoding="utf8") as f:
+            for line in f:
+                word, frequency = line.rstrip("\n").split("\t")
+                frequencies[word] = int(frequency)
+        self._frequencies = frequencies
+
+    def context_index(self):
+        """Return the inverted index of the training data, which maps each word to the positions where it occurs.
+
+        The index is built on first use. If the training data is a CorpusStore on disk in whose directory an index
+        was saved with save_context_index(), that index is memory-mapped instead.
         """
         if self.training_data is None:
             raise ValueError("This function needs access to the training data. "
                              "Please load the training data with the 'load_training_data()' "
                              "function and then try again. ")
-        context = []
-        for sentence in self.training_data:
-            for idx, token in enumerate(sentence):
-                if word == token:
-                    start = 0 if (idx - n < 0) else idx - n
-                    stop = len(sentence)-1 if (idx + n > len(sentence)-1) else idx + n
-                    string = " ".join(sentence[start:stop+1])
-                    context.append(string)
-        return context
 
-    def frequency_in_training_data(self, word):
-        """Return how often the word appears in the training data. Only works if training data was loaded."""
+        if self._context_index is None:
+            path = self.training_data.path
+            if path is not None and ContextIndex.exists(path):
+                self._context_index = ContextIndex.load(path)
+                if not self._context_index.fits(self.training_data):
+                    print("INFO: The index in {} does not fit the training data and is rebuilt.".format(path))
+                    self._context_index = None
+            if self._context_index is None:
+                self._context_index = ContextIndex.build(self.training_data)
+        return self._context_index
+
+    def save_context_index(self, path=None):
+        """Save the inverted index of the training data, see context_index().
+
+        Args:
+            path (str): directory to save the index in, defaults to the directory of the training data if it
+                was loaded from a CorpusStore
+        """
+        if path is None:
+            path = self.training_data.path if self.training_data is not None else None
+            if path is None:
+                raise ValueError("The training data was not loaded from a CorpusStore directory, "
+                                 "please specify the path to save the index in.")
+        self.context_index().save(path)
+
+    def load_context_index(self, path, mmap=True):
+        """Load an inverted index saved with save_context_index() for the loaded training data."""
         if self.training_data is None:
             raise ValueError("This function needs access to the training data. "
                              "Please load the training data with the 'load_training_data()' "
                              "function and then try again. ")
 
-        counter = 0
-        for document in self.training_data:
-            for wrd in document:
-                if wrd == word:
-                    counter += 1
+        index = ContextIndex.load(path, mmap=mmap)
+        if not index.fits(self.training_data):
+            raise ValueError("The index in {} was not built from the loaded training data.".format(path))
+        self._context_index = index
 
-        return counter
+    def context_in_training_data(self, word, n=3, limit=None, random_sample=False, seed=None):
+        """Return the contexts in which the word appears in the training data. Only works if training data was loaded.
+
+        The occurrences are looked up in an inverted index (see context_index()), so a lookup costs the number of
+        hits rather than the size of the corpus.
+
+        Args:
+            word (str): Word to search for
+            n (int): number of neighbouring words to print
+            limit (int): maximum number of contexts to return
+            random_sample (bool): if True and there are more than 'limit' hits, return a random sample of the hits
+                instead of the first ones
+            seed (int): seed for the random sample
+        """
+        index = self.context_index()
+        store = self.training_data
+
+        word_id = store.word_index.get(word)
+        if word_id is None:
+            return []
+
+        positions = np.asarray(index.positions_of(word_id), dtype=np.int64)
+        if limit is not None and len(positions) > limit:
+            if random_sample:
+                rng = np.random.RandomState(seed)
+                positions = np.sort(rng.choice(positions, size=limit, replace=False))
+            else:
+                positions = positions[:limit]
+
+        # clip the context windows to the sentences the hits are in
+        sentences = np.searchsorted(store.offsets, positions, side="right") - 1
+        starts = np.maximum(positions - n, store.offsets[sentences])
+        stops = np.minimum(positions + n + 1, store.offsets[sentences + 1])
+
+        vocab = store.vocab
+        return [" ".join(vocab[i] for i in store.tokens[start:stop].tolist())
+                for start, stop in zip(starts.tolist(), stops.tolist())]
+
+    def frequency_in_training_data(self, word):
+        """Return how often the word appears in the training data, see frequency_table()."""
+        return self.frequency_table()[word]
 
     def sort_by_frequency_in_training_data(self, list_of_words):
         """Return a table in which the words are sorted by the frequency with which they appear in the training data."""
-        freqs = [self.frequency_in_training_data(word) for word in list_of_words]
+        frequencies = self.frequency_table()
+        freqs = [frequencies[word] for word in list_of_words]
         res = pd.DataFrame({'Word': list_of_words, 'Frequency': freqs})
         res = res.sort_values(by='Frequency', axis=0, ascending=False)
         res = res.reset_index(drop=True)
@@ -170,18 +317,13 @@ class WordEmbedding:
              more_frequent_than (int): only return words up to frequency "up_to"
         """
 
-        if self.training_data is None:
-            raise ValueError("This function needs access to the training data. "
-                             "Please load the training data with the 'load_training_data()' "
-                             "function and then try again. ")
-
         if more_frequent_than == 0:
             more_frequent_than = None
 
-        flat_training_data = [wrd for document in self.training_data for wrd in document]
-        c = Counter(flat_training_data)
+        most_common = self.frequency_table().most_common()
 
-        res = pd.DataFrame({"Word": c.keys(), "Frequency": c.values()})
+        res = pd.DataFrame({"Word": [word for word, _ in most_common],
+                            "Frequency": [frequency for _, frequency in most_common]})
         if first_n is not None:
             res = res.head(n=first_n)
         if more_frequent_than is not None:
@@ -195,10 +337,7 @@ class WordEmbedding:
                              "Please load the training data with the 'load_training_data()' "
                              "function and then try again. ")
 
-        counter = 0
-        for sentence in self.training_data:
-            counter += len(sentence)
-        return counter
+        return self.training_data.n_tokens()
 
     def vocab_containing(self, word_part, show_frequency=False):
         """Return all words in the vocab that contain the word_part as a substring.
@@ -209,26 +348,26 @@ class WordEmbedding:
         If the training data is loaded, this function will show frequencies as well.
         """
         if show_frequency:
-            if self.training_data is None:
-                raise ValueError("This function needs access to the training data. "
-                                 "Please load the training data with the 'load_training_data()' "
-                                 "function and then try again. ")
-
-            subset = [[w, self.frequency_in_training_data(w)] for w in sorted(list(self._word_vectors.vocab)) if word_part in w]
+            frequencies = self.frequency_table()
+            subset = [[w, frequencies[w]] for w in self.vocab() if word_part in w]
             subset = pd.DataFrame(subset, columns=["Word", "Frequency"])
             subset = subset.sort_values(by='Frequency', axis=0, ascending=False)
         else:
-            subset = [w for w in sorted(list(self._word_vectors.vocab)) if word_part in w]
+            subset = [w for w in self.vocab() if word_part in w]
         return subset
 
     def vector(self, word):
-        """Return the normalized vector representation of 'word' in the embedding."""
+        """Return the normalized vector representation of 'word' in the embedding.
+
+        The vector is a read-only view into the embedding's matrix, copy it before modifying it in place.
+        """
 
-        return normalize_vector(self._word_vectors[word])
+        return self._matrix[self._row(word)]
 
     def vectors(self, list_of_words):
-        """Return a list of the normalized vector representations of each 'word' in 'list_of_words'."""
-        return [self.vector(word) for word in list_of_words]
+        """Return an array of shape (len(list_of_words), dim) whose rows are the normalized vector
+        representations of each 'word' in 'list_of_words'."""
+        return self._matrix[[self._row(word) for word in list_of_words]]
 
     def difference_vector(self, word1, word2, normalize=False):
         """Return the difference vector of 'word1' and 'word2'.
@@ -267,8 +406,7 @@ class WordEmbedding:
     def centroid_of_vectors(self, list_of_words, normalize=False):
         """Return the centroid vector of the words provided."""
 
-        vecs = [self.vector(word) for word in list_of_words]
-        vecs = np.array(vecs)
+        vecs = self.vectors(list_of_words)
         centroid = np.mean(vecs, axis=0)
         if normalize:
             return normalize_vector(centroid)
@@ -284,8 +422,7 @@ class WordEmbedding:
             list of arrays
         """
 
-        X = [self.vector(word) for word in list_of_words]
-        X = np.array(X)
+        X = self.vectors(list_of_words)
         pca_transformer = PCA(n_components=n_components)
         pca_transformer.fit_transform(X)
 
@@ -304,8 +441,7 @@ class WordEmbedding:
             list
         """
 
-        X = [self.vector(word) for word in list_of_words]
-        X = np.array(X)
+        X = self.vectors(list_of_words)
         pca_transformer = PCA(n_components=n_components)
         pca_transformer.fit_transform(X)
 
@@ -316,64 +452,265 @@ class WordEmbedding:
         """Return the similarity between 'word1' and 'word2'. The result is a value between -1 and 1."""
         return np.dot(self.vector(word1), self.vector(word2))
 
-    def similarities(self, list_of_word_pairs):
-        """Return the cosine similarities between words in list of word pairs."""
-        result = [[word1, word2, round(self.similarity(word1, word2), 3)] for word1, word2 in list_of_word_pairs]
+    def similarity_matrix(self, words_a, words_b=None, nonlinear=False, scaling=2, chunk_size=None):
+        """Return the similarities between all words in 'words_a' and all words in 'words_b' as one matrix product
+        of their normalized vectors.
+
+        Args:
+            words_a (list[str]): words of the rows
+            words_b (list[str]): words of the columns, defaults to 'words_a'
+            nonlinear (bool): if True, return tanh(scaling * similarity) instead, which spreads out high similarities
+            scaling (float): scaling factor of the nonlinear similarity
+            chunk_size (int): if given, compute the matrix in blocks of this many rows, so that only one block of
+                vectors of 'words_a' is gathered at a time
+
+        Returns:
+            ndarray of shape (len(words_a), len(words_b))
+        """
+        words_a = list(words_a)
+        vecs_b = self.vectors(words_a if words_b is None else list(words_b))
+
+        if chunk_size is None:
+            chunk_size = max(len(words_a), 1)
+
+        result = np.empty((len(words_a), len(vecs_b)), dtype=self._matrix.dtype)
+        for start in range(0, len(words_a), chunk_size):
+            block = result[start:start + chunk_size]
+            np.matmul(self.vectors(words_a[start:start + chunk_size]), vecs_b.T, out=block)
+            if nonlinear:
+                np.tanh(scaling * block, out=block)
+        return result
+
+    def similarities(self, list_of_word_pairs, return_ndarray=False):
+        """Return the cosine similarities between words in list of word pairs.
+
+        Args:
+            list_of_word_pairs (list): list of pairs of words
+            return_ndarray (bool): if True, return the similarities as an array in the order of the pairs instead
+                of a sorted DataFrame
+
+        Returns:
+            DataFrame or ndarray
+        """
+        words1 = [word1 for word1, _ in list_of_word_pairs]
+        words2 = [word2 for _, word2 in list_of_word_pairs]
+        sims = np.einsum('ij,ij->i', self.vectors(words1), self.vectors(words2))
+        if return_ndarray:
+            return sims
+
+        result = {'Word1': words1, 'Word2': words2, 'Similarity': sims.round(3)}
         result_dataframe = pd.DataFrame(result, columns=['Word1', 'Word2', 'Similarity'])
         result_dataframe = result_dataframe.sort_values(["Similarity"], axis=0)
         return result_dataframe
 
-    def most_similar(self, word, n=10):
-        """Return the words most similar to 'word'."""
+    def ann_index_path(self):
+        """Return the directory in which the approximate nearest neighbour index is saved, next to the .emb file."""
+        return self._embedding_file + ".ivf"
+
+    def build_ann_index(self, n_lists=None, n_iter=10, seed=0, save=True):
+        """Build the index for approximate nearest neighbour search, see neighbours.IVFIndex.
+
+        Args:
+            n_lists (int): number of clusters, defaults to the square root of the vocab size
+            n_iter (int): number of k-means iterations
+            seed (int): seed of the k-means initialisation
+            save (bool): if True, save the index next to the .emb file, so that it is loaded from there later
+
+        Returns:
+            IVFIndex
+        """
+        print("Building approximate nearest neighbour index...")
+        start = time.perf_counter()
+        self._ann_index = IVFIndex.build(self._matrix, n_lists=n_lists, n_iter=n_iter, seed=seed,
+                                         fingerprint=vocab_fingerprint(self._word_vectors.index2word))
+        print("...done in {:.1f}s.".format(time.perf_counter() - start))
+        if save:
+            self._ann_index.save(self.ann_index_path())
+        return self._ann_index
+
+    def ann_index(self):
+        """Return the approximate nearest neighbour index. It is loaded from next to the .emb file if it was
+        saved there for the same vocab, and built and saved otherwise. If the index cannot be saved, for example
+        because the directory of the embedding is read-only, it is only kept in memory."""
+        if self._ann_index is None:
+            path = self.ann_index_path()
+            if IVFIndex.exists(path):
+                self._ann_index = IVFIndex.load(path, mmap=True)
+                if self._ann_index.fingerprint != vocab_fingerprint(self._word_vectors.index2word):
+                    print("INFO: The index in {} does not fit the vocab and is rebuilt.".format(path))
+                    self._ann_index = None
+            if self._ann_index is None:
+                self.build_ann_index(save=False)
+                try:
+                    self._ann_index.save(path)
+                except OSError as e:
+                    print("INFO: The index could not be saved in {} and is only kept in memory: {}".format(path, e))
+        return self._ann_index
+
+    def ann_recall(self, n_probes=(1, 2, 4, 8, 16, 32), n=10, n_queries=100, seed=0):
+        """Measure the recall and speed of approximate nearest neighbour search, to choose 'n_probe'.
+
+        Random vocab words are queried exactly and approximately. The recall is the fraction of the exact n
+        nearest neighbours that the approximate search finds.
 
-        ms = self._word_vectors.most_similar(word, topn=n)
+        Args:
+            n_probes (list[int]): numbers of clusters to search per query
+            n (int): number of neighbours
+            n_queries (int): number of random query words
+            seed (int): seed of the random choice of query words
+
+        Returns:
+            DataFrame with the recall and the milliseconds per query for each n_probe, and for the exact search
+        """
+        rng = np.random.RandomState(seed)
+        vocab = self._word_vectors.index2word
+        queries = [([vocab[row]], []) for row in rng.choice(len(vocab), size=min(n_queries, len(vocab)),
+                                                            replace=False)]
+        index = self.ann_index()
+
+        start = time.perf_counter()
+        exact = self._neighbours(queries, n)
+        exact_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+        result = []
+        for n_probe in n_probes:
+            start = time.perf_counter()
+            approx = self._neighbours(queries, n, approximate=True, n_probe=n_probe)
+            ms = 1000 * (time.perf_counter() - start) / len(queries)
+            recall = np.mean([len({w for w, _ in a} & {w for w, _ in e}) / max(len(e), 1)
+                              for a, e in zip(approx, exact)])
+            result.append([n_probe, recall, ms])
+        result.append(["exact", 1.0, exact_ms])
+
+        print("INFO: Index with {} clusters.".format(len(index.centroids)))
+        return pd.DataFrame(result, columns=["n_probe", "recall", "ms_per_query"])
+
+    def _neighbours(self, queries, n, largest=True, approximate=False, n_probe=N_PROBE):
+        """Return the n nearest (or farthest) words of each query as a list of (word, similarity) tuples.
+
+        Each query is a pair of lists of positive and negative words or vectors, see neighbours.query_vector().
+        The words of a query are never among its neighbours. With 'approximate', the nearest words are searched
+        in the 'n_probe' closest clusters of the approximate nearest neighbour index only.
+        """
+        vecs = []
+        exclude = []
+        for positive, negative in queries:
+            vec, rows = query_vector(self._matrix, self._index, positive=positive, negative=negative)
+            vecs.append(vec)
+            exclude.append(rows)
+
+        vocab = self._word_vectors.index2word
+        vecs = np.array(vecs).reshape(len(vecs), self._matrix.shape[1])
+        if approximate:
+            if not largest:
+                raise ValueError("The approximate search only finds the most similar words.")
+            results = self.ann_index().search(self._matrix, vecs, n, exclude=exclude, n_probe=n_probe)
+        else:
+            results = top_k(self._matrix, vecs, n, exclude=exclude, largest=largest)
+        return [[(vocab[row], float(sim)) for row, sim in zip(rows.tolist(), sims.tolist())]
+                for rows, sims in results]
+
+    @staticmethod
+    def _as_query(word):
+        """Turn a word, a vector or a list of words and vectors into a query of positive items."""
+        if isinstance(word, (str, np.ndarray)):
+            return [word], []
+        return list(word), []
+
+    def most_similar(self, word, n=10, approximate=False, n_probe=N_PROBE):
+        """Return the words most similar to 'word', which can also be a vector or a list of words and vectors
+        whose mean is used.
+
+        With 'approximate', only the 'n_probe' closest clusters of the approximate nearest neighbour index are
+        searched, see ann_index() and ann_recall()."""
+
+        ms = self._neighbours([self._as_query(word)], n, approximate=approximate, n_probe=n_probe)[0]
         ms = [(word, round(s, 3)) for word, s in ms]
         return ms
 
-    def most_similar_by_vector(self, vector, n=10):
-        """Return the words most similar to 'vector'."""
+    def most_similar_many(self, list_of_words, n=10, approximate=False, n_probe=N_PROBE):
+        """Return the words most similar to each word in 'list_of_words' (which may also contain vectors), with
+        all queries answered in one pass over the vocabulary. See most_similar() for the other arguments.
+
+        Returns:
+            list with a list of (word, similarity) tuples for each query
+        """
+
+        results = self._neighbours([self._as_query(word) for word in list_of_words], n, approximate=approximate,
+                                   n_probe=n_probe)
+        return [[(word, round(s, 3)) for word, s in ms] for ms in results]
 
-        return self._word_vectors.similar_by_vector(vector, topn=n)
+    def most_similar_by_vector(self, vector, n=10, approximate=False, n_probe=N_PROBE):
+        """Return the words most similar to 'vector'. See most_similar() for the other arguments."""
+
+        return self._neighbours([([vector], [])], n, approximate=approximate, n_probe=n_probe)[0]
 
     def least_similar(self, word, n=10):
         """Return the words least similar to 'word'."""
-        most_sim = self._word_vectors.most_similar(word, topn=self.vocab_size())
-        last_n = most_sim[-n:]
-        return last_n[::-1]
+        return self._neighbours([self._as_query(word)], n, largest=False)[0]
 
     def least_similar_by_vector(self, vector, n=10):
         """Return the words least similar to 'word'."""
         return self.most_similar_by_vector(-vector, n=n)
 
-    def similarities_of_differences(self, list_of_word_pairs):
-        """Construct the difference vectors for each word pair and return a dictionary of their similarities."""
-
-        # make all unique combinations of pairs
-        combinations_all_pairs = combinations_with_replacement(list_of_word_pairs, 2)
-        # remove doubles - somehow the usual '==' does not work in colab
-        combinations_all_pairs = [c for c in combinations_all_pairs if c[0][0] != c[1][0] or c[0][1] != c[1][1]]
-
-        result = []
-        for combination in list(combinations_all_pairs):
-            pair1 = combination[0]
-            pair2 = combination[1]
+    def similarities_of_differences(self, list_of_word_pairs, return_ndarray=False, chunk_size=None):
+        """Construct the difference vectors for each word pair and return their similarities.
 
-            # compute difference vectors
-            diff_pair1 = self.vector(pair1[0]) - self.vector(pair1[1])
-            diff_pair2 = self.vector(pair2[0]) - self.vector(pair2[1])
+        The normalized differences are stacked into one matrix, and the similarities of all combinations of two
+        pairs are taken from its Gram matrix, which is computed in blocks of 'chunk_size' rows.
 
-            # normalise differences
-            diff_pair1 = normalize_vector(diff_pair1)
-            diff_pair2 = normalize_vector(diff_pair2)
-
-            sim = np.dot(diff_pair1, diff_pair2)
-            sim = round(sim, 4)
-
-            # save in nice format
-            entry1 = pair1[0] + " - " + pair1[1]
-            entry2 = pair2[0] + " - " + pair2[1]
-            result.append([entry1, entry2, sim])
+        Args:
+            list_of_word_pairs (list): list of pairs of words
+            return_ndarray (bool): if True, return the similarities of all combinations i < j of pairs as a condensed
+                1d array in the order of scipy.spatial.distance.squareform(), including combinations of a pair with
+                an equal pair; otherwise return a DataFrame that leaves those out
+            chunk_size (int): number of rows of the Gram matrix computed at a time, by default all of them
 
+        Returns:
+            DataFrame or ndarray
+        """
+        n_pairs = len(list_of_word_pairs)
+        diffs = (self.vectors([word1 for word1, _ in list_of_word_pairs])
+                 - self.vectors([word2 for _, word2 in list_of_word_pairs]))
+
+        # normalise differences
+        norms = np.linalg.norm(diffs, axis=1)
+        if n_pairs > 1 and np.any(norms == 0):
+            raise ValueError("vector is zero, cannot normalize!")
+        diffs /= np.maximum(norms, np.finfo(diffs.dtype).tiny)[:, np.newaxis]
+
+        if chunk_size is None:
+            chunk_size = max(n_pairs, 1)
+
+        # upper triangle of the Gram matrix, row by row
+        sims = np.empty(n_pairs * (n_pairs - 1) // 2, dtype=diffs.dtype)
+        rows = []
+        cols = []
+        pos = 0
+        for start in range(0, n_pairs, chunk_size):
+            gram = diffs[start:start + chunk_size] @ diffs.T
+            row, col = np.triu_indices(len(gram), k=start + 1, m=n_pairs)
+            sims[pos:pos + len(row)] = gram[row, col]
+            pos += len(row)
+            if not return_ndarray:
+                rows.append(row + start)
+                cols.append(col)
+
+        if return_ndarray:
+            return sims
+
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=int)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=int)
+
+        # remove combinations of equal pairs
+        pair_ids = {}
+        ids = np.array([pair_ids.setdefault((word1, word2), len(pair_ids)) for word1, word2 in list_of_word_pairs],
+                       dtype=np.int64)
+        keep = ids[rows] != ids[cols]
+
+        # save in nice format
+        entries = np.array([word1 + " - " + word2 for word1, word2 in list_of_word_pairs], dtype=object)
+        result = {'Pair1': entries[rows[keep]], 'Pair2': entries[cols[keep]], 'Alignment': sims[keep].round(4)}
         result_dataframe = pd.DataFrame(result, columns=['Pair1', 'Pair2', 'Alignment'])
         return result_dataframe
 
@@ -404,7 +741,9 @@ class WordEmbedding:
     def analogy(self, positive_list, negative_list, n=10):
         """Returns words close to positive words and far away from negative words, as
         proposed in https://www.aclweb.org/anthology/W14-1618.pdf"""
-        return self._word_vectors.most_similar(positive=positive_list, negative=negative_list, topn=n)
+        positive = self._as_query(positive_list)[0]
+        negative = self._as_query(negative_list)[0]
+        return self._neighbours([(positive, negative)], n)[0]
 
     def projection(self, test_word, word_pair):
         """Compute the projection of a word to the normalized difference vector of the word pair.
@@ -441,11 +780,47 @@ class WordEmbedding:
                 result.append([word, word_pair[0] + " - " + word_pair[1], projection])
 
         result_dataframe = pd.DataFrame(result, columns=['test', 'dimension', 'projection'])
-        if self.training_data is not None:
-            result_dataframe['test_freq'] = [self.frequency_in_training_data(word) for word in result_dataframe['test']]
+        if self.training_data is not None or self._frequencies is not None:
+            frequencies = self.frequency_table()
+            result_dataframe['test_freq'] = [frequencies[word] for word in result_dataframe['test']]
         return result_dataframe
 
-    def projections_to_bipolar_dimensions(self, test, dimensions, normalize_before=False, normalize_centroids=True):
+    def _test_words_and_matrix(self, test):
+        """Return the list of test words and the matrix of their vectors. 'test' can be a single word, a list of
+        words, or None for the entire vocabulary."""
+        if test is None:
+            return list(self._index), self._matrix
+        test_words = [test] if isinstance(test, str) else list(test)
+        return test_words, self.vectors(test_words)
+
+    @staticmethod
+    def _projections_frame(test_words, projections, dim_names):
+        """Return the projections of the test words as a data frame sorted by the dimensions."""
+        df = pd.DataFrame(projections, columns=dim_names)
+        df.insert(0, "test_word", test_words)
+        df = df.sort_values(dim_names, axis=0, ascending=False)
+        return df
+
+    def bipolar_dimension_matrix(self, dimensions, normalize_before=False, normalize_centroids=True):
+        """Return an array of shape (n_dimensions, dim) whose rows are the bipolar dimensions generated by the
+        clusters in 'dimensions'. See projections_to_bipolar_dimensions() for the arguments.
+
+        The dimension vectors are cached, so asking again for dimensions with the same generating words is cheap."""
+
+        dimension_set = DimensionSet.make(dimensions, bipolar=True)
+        return dimension_set.basis(self, normalize_before=normalize_before, normalize_centroids=normalize_centroids)
+
+    def unipolar_dimension_matrix(self, dimensions, normalize_before=True):
+        """Return an array of shape (n_dimensions, dim) whose rows are the unipolar dimensions generated by the
+        clusters in 'dimensions'. See projections_to_unipolar_dimensions() for the arguments.
+
+        The dimension vectors are cached, so asking again for dimensions with the same generating words is cheap."""
+
+        dimension_set = DimensionSet.make(dimensions, bipolar=False)
+        return dimension_set.basis(self, normalize_before=normalize_before)
+
+    def projections_to_bipolar_dimensions(self, test, dimensions, normalize_before=False, normalize_centroids=True,
+                                          return_ndarray=False):
         """ Compute the projections of test words onto bipolar dimensions. Each bipolar dimension is constructed from
         two clusters of words.
 
@@ -460,110 +835,74 @@ class WordEmbedding:
 
         * Computing the projection onto the centroid of differences between word pairs formed from the cluster.
 
+        The dimensions are computed once, and all test words are projected with a single matrix product.
+
          Args:
-            test (str or list[str]): test word like 'land' OR list of test
-              words like ['land', 'nurse',...]
-            dimensions (dict): dictionary of lists of two clusters like
+            test (str or list[str] or None): test word like 'land' OR list of test
+              words like ['land', 'nurse',...] OR None to project the entire vocabulary
+            dimensions (dict or DimensionSet): dictionary of lists of two clusters like
 
                     {'gender (male-female)': [['man', 'he',...], ['girl', 'her',...]],
                      'race (black-white)': [['black', ...], ['white', ...]],
                      ...
                      }
+
+              or a DimensionSet of bipolar dimensions
+            return_ndarray (bool): if True, return the unsorted (n_test_words, n_dimensions) array of
+              projections instead of a DataFrame
         Returns:
-            DataFrame
+            DataFrame or ndarray
         """
-        if isinstance(test, str):
-            test_words = [test]
-        else:
-            test_words = test
-
-        data = []
-        for test_word in test_words:
-
-            test_vec = self.vector(test_word)
-            row = [test_word]
-
-            for dim_clusters in dimensions.values():
-
-                if len(dim_clusters) != 2:
-                    raise ValueError("Generating words must be a list of exactly two lists that contain words.")
-
-                centroid_left_cluster = self.centroid_of_vectors(dim_clusters[0])
-                centroid_right_cluster = self.centroid_of_vectors(dim_clusters[1])
-                
-                if normalize_centroids:
-                    centroid_left_cluster = centroid_left_cluster/np.linalg.norm(centroid_left_cluster)
-                    centroid_right_cluster = centroid_right_cluster/np.linalg.norm(centroid_right_cluster)
-                    
-                diff = centroid_left_cluster - centroid_right_cluster
-                if normalize_before:
-                    diff = normalize_vector(diff)
-                res = np.dot(test_vec, diff)
-                row.append(res)
+        test_words, test_matrix = self._test_words_and_matrix(test)
 
-            data.append(row)
+        dimensions = DimensionSet.make(dimensions, bipolar=True)
+        dim_matrix = self.bipolar_dimension_matrix(dimensions, normalize_before=normalize_before,
+                                                   normalize_centroids=normalize_centroids)
+        projections = test_matrix @ dim_matrix.T
 
-        cols = ["test_word"] + list(dimensions)
+        if return_ndarray:
+            return projections
+        return self._projections_frame(test_words, projections, dimensions.names())
 
-        df = pd.DataFrame(data, columns=cols)
-        df = df.sort_values(cols[1:], axis=0, ascending=False)
-        return df
-
-    def projections_to_unipolar_dimensions(self, test, dimensions, normalize_before=True):
+    def projections_to_unipolar_dimensions(self, test, dimensions, normalize_before=True, return_ndarray=False):
         """Compute the projection of a test word onto unipolar dimensions.
 
            The unipolar dimension is the centroid of a cluster of words.
 
         Args:
-            test (str or list[str]): test word like 'land' OR list of test
-                                        words like ['land', 'nurse',...]
-            dimensions (dict): dictionary of clusters like
+            test (str or list[str] or None): test word like 'land' OR list of test
+                                        words like ['land', 'nurse',...] OR None for the entire vocabulary
+            dimensions (dict or DimensionSet): dictionary of clusters like
 
                     {'male': ['man', 'he',...]
                      'female': ['him', 'her' ...],
                      ...
                      }
+
+                                        or a DimensionSet of unipolar dimensions
+            return_ndarray (bool): if True, return the unsorted (n_test_words, n_dimensions) array of
+                                        projections instead of a DataFrame
         Returns:
-            DataFrame
+            DataFrame or ndarray
         """
-        if isinstance(test, str):
-            test_words = [test]
-        else:
-            test_words = test
-
-        data = []
-        for test_word in test_words:
-
-            test_vec = self.vector(test_word)
-            row = [test_word]
-
-            for dim_cluster in dimensions.values():
-
-                if len(np.array(dim_cluster).shape) != 1:
-                    raise ValueError("Generating words must be a list of words.")
-
-                centroid = self.centroid_of_vectors(dim_cluster)
-                if normalize_before:
-                    centroid = normalize_vector(centroid)
-                res = np.dot(test_vec, centroid)
-                row.append(res)
+        test_words, test_matrix = self._test_words_and_matrix(test)
 
-            data.append(row)
+        dimensions = DimensionSet.make(dimensions, bipolar=False)
+        dim_matrix = self.unipolar_dimension_matrix(dimensions, normalize_before=normalize_before)
+        projections = test_matrix @ dim_matrix.T
 
-        cols = ["test_word"] + list(dimensions)
+        if return_ndarray:
+            return projections
+        return self._projections_frame(test_words, projections, dimensions.names())
 
-        df = pd.DataFrame(data, columns=cols)
-        df = df.sort_values(cols[1:], axis=0, ascending=False)
-        return df
-
-    def projections_to_principal_components(self, test, dimensions, n_components=3, n=5):
+    def projections_to_principal_components(self, test, dimensions, n_components=3, n=5, return_ndarray=False):
         """Compute the projection of a test word onto the first n_components principal vectors.
 
         The n words closest to those principal vectors are printed to get a feeling for what these components mean.
 
         Args:
-            test (str or list[str]): test word like 'land' OR list of test
-                                        words like ['land', 'nurse',...]
+            test (str or list[str] or None): test word like 'land' OR list of test
+                                        words like ['land', 'nurse',...] OR None for the entire vocabulary
             dimensions (dict): dictionary of clusters like
 
                     {'male': ['man', 'he',...]
@@ -572,46 +911,35 @@ class WordEmbedding:
                      }
             n_components (int): number of components to consider
             n (int): number of similar words to print
+            return_ndarray (bool): if True, return the unsorted (n_test_words, n_dimensions * n_components) array
+                                        of projections instead of a DataFrame
 
         Returns:
-            DataFrame
+            DataFrame or ndarray
         """
-        if isinstance(test, str):
-            test_words = [test]
-        else:
-            test_words = test
+        test_words, test_matrix = self._test_words_and_matrix(test)
 
         # collect principal vectors
-        principal_vecs = {}
-        cols = ["test_word"]
+        principal_vecs = []
+        cols = []
         for dim_name, dim_cluster in dimensions.items():
 
             if len(np.array(dim_cluster).shape) != 1:
                 raise ValueError("Generating words must be a list of words.")
 
             p_vecs = self.principal_components(dim_cluster, n_components=n_components, normalize=True)
-            principal_vecs[dim_name] = p_vecs
+            principal_vecs.extend(p_vecs)
 
             for idx, vec in enumerate(p_vecs):
                 cols += ["{}-P{}".format(dim_name, idx+1)]
                 print("{}-P{} is similar to: ".format(dim_name, idx), self.most_similar([vec], n=n))
 
-        data = []
-        for test_word in test_words:
+        dim_matrix = np.array(principal_vecs, dtype=self._matrix.dtype).reshape(len(cols), self._matrix.shape[1])
+        projections = test_matrix @ dim_matrix.T
 
-            test_vec = self.vector(test_word)
-            row = [test_word]
-            for dim_name, p_vecs in principal_vecs.items():
-
-                for vec in p_vecs:
-                    res = np.dot(test_vec, vec)
-                    row.append(res)
-
-            data.append(row)
-
-        df = pd.DataFrame(data, columns=cols)
-        df = df.sort_values(cols[1:], axis=0, ascending=False)
-        return df
+        if return_ndarray:
+            return projections
+        return self._projections_frame(test_words, projections, cols)
 
     def cluster_diversity(self, list_of_words, method="centroid_length", **kwargs):
         """Compute a measure of the diversity of a list of words.
@@ -631,20 +959,15 @@ class WordEmbedding:
 
     def plot_diversity(self, list_of_words, bandwidth=0.1):
         """Plot density of the mutual similarities of all words. """
-        similarities = []
-        for word1, word2 in combinations(list_of_words, 2):
-            similarities.append(self.similarity(word1, word2))
+        # all pairs of different words, each once
+        similarities = self.similarity_matrix(list_of_words)[np.triu_indices(len(list_of_words), k=1)]
 
         sns.kdeplot(np.array(similarities), bw_method=bandwidth)
         plt.xlim(-1, 1)
 
     def plot_distance_graph(self, list_of_words, nonlinear=False, scaling=2, padding=1.2):
         """Plot a network where edge length shows the similarity between words"""
-        if nonlinear:
-            covariance_list = [np.tanh(scaling*self.similarity(word1, word2)) for word1, word2 in product(list_of_words, repeat=2)]
-        else:
-            covariance_list = [self.similarity(word1, word2) for word1, word2 in product(list_of_words, repeat=2)]
-        covariance = np.array(covariance_list).reshape(len(list_of_words), len(list_of_words))
+        covariance = self.similarity_matrix(list_of_words, nonlinear=nonlinear, scaling=scaling)
         graph = nx.from_numpy_array(covariance)
         mapping = {i: word for i, word in enumerate(list_of_words)}
         graph = nx.relabel_nodes(graph, mapping)
@@ -664,16 +987,11 @@ class WordEmbedding:
 
     def plot_distance_matrix(self, list_of_words, size=5, nonlinear=False, scaling=2, normalize=False, min=-1):
         """Plot a matrix where each value shows the similarity between words"""
-        if nonlinear:
-            covariance_list = [np.tanh(scaling*self.similarity(word1, word2)) for word1, word2 in product(list_of_words, repeat=2)]
-        else:
-            covariance_list = [self.similarity(word1, word2) for word1, word2 in product(list_of_words, repeat=2)]
-
-        covariance = np.array(covariance_list).reshape(len(list_of_words), len(list_of_words))
+        covariance = self.similarity_matrix(list_of_words, nonlinear=nonlinear, scaling=scaling)
 
         plt.figure(figsize=(size, size))
         if normalize:
-            plt.imshow(covariance, aspect='equal', cmap='BrBG', vmin=min(covariance_list), vmax=max(covariance_list))
+            plt.imshow(covariance, aspect='equal', cmap='BrBG', vmin=covariance.min(), vmax=covariance.max())
         else:
             plt.imshow(covariance, aspect='equal', cmap='BrBG', vmin=min, vmax=1)
 
@@ -690,7 +1008,7 @@ class WordEmbedding:
             list_of_words (List[str]): list of words
             n_comp (int): number of principal components
         """
-        X = np.array([self.vector(word) for word in list_of_words])
+        X = self.vectors(list_of_words)
         pca_transformer = PCA(n_components=n_comp)
         pca = pca_transformer.fit_transform(X)
 
@@ -710,7 +1028,7 @@ class WordEmbedding:
             n_comp (int): number of principal components
         """
 
-        X = np.array([self.vector(word) for word in list_of_words])
+        X = self.vectors(list_of_words)
         tsne = TSNE(n_components=tsne_ncomp, random_state=0, perplexity=pep).fit_transform(X)
 
         plt.figure()
@@ -732,7 +1050,7 @@ class WordEmbedding:
         """
         list_of_words = list_of_words.copy()
 
-        vecs = [self.vector(word) for word in list_of_words]
+        vecs = list(self.vectors(list_of_words))
 
         extra_vecs = []
         extra_words = []
@@ -764,9 +1082,13 @@ class WordEmbedding:
 class EmbeddingEnsemble:
     """Applies actions to an list_of_embeddings of trained embeddings."""
 
-    def __init__(self, path_to_embeddings):
-
-        self.list_of_embeddings = []
+    def __init__(self, path_to_embeddings, mmap=False, workers=1):
+        """
+        Args:
+            path_to_embeddings (str or list[str]): list of paths to .emb files, or a path prefix shared by them
+            mmap (bool): if True, memory-map the vector matrices of all embeddings, see WordEmbedding
+            workers (int): number of embeddings that are loaded concurrently
+        """
 
         if isinstance(path_to_embeddings, list):
 
@@ -774,26 +1096,52 @@ class EmbeddingEnsemble:
 
         else:
 
-            paths = glob.glob(path_to_embeddings + '*.emb')
+            paths = sorted(glob.glob(path_to_embeddings + '*.emb'))
 
             if len(paths) == 0:
                 raise EmbeddingError("Failed to find any appropriate file. Please make sure that "
                                      "there are trained embeddings under this path.".format(path_to_embeddings))
 
-        # Iterate through all paths
-        for path in paths:
-
-            try:
-                # load the word vectors of an embedding
-                emb = WordEmbedding(path)
-            except FileNotFoundError:
-                raise EmbeddingError("Failed to load the trained embeddings {}. Please make sure that "
-                                     "the path to this file really exists.".format(path))
+        start = time.perf_counter()
+        if workers > 1:
+            # only the reads of the .npy files and the normalization of the vectors release the GIL and overlap;
+            # unpickling the vocab dict of the KeyedVectors and building the word index hold it and run one at a
+            # time. Threads still avoid sending the loaded embeddings between processes
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self._load_embedding, path, mmap) for path in paths]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except EmbeddingError:
+                    # fail fast: do not start loading the remaining embeddings
+                    for future in futures:
+                        future.cancel()
+                    raise
+            loaded = [future.result() for future in futures]
+        else:
+            loaded = [self._load_embedding(path, mmap) for path in paths]
 
-            self.list_of_embeddings.append(emb)
+        self.list_of_embeddings = [emb for emb, _ in loaded]
+        self.loading_times = {path: seconds for path, (_, seconds) in zip(paths, loaded)}
+        self._shared_rows = None
 
         self.description = "This object represents the list_of_embeddings {} of {} word trained embeddings."\
             .format(path_to_embeddings, len(self.list_of_embeddings))
+        print("Loaded {} embeddings in {:.1f}s ({}).".format(
+            len(self.list_of_embeddings), time.perf_counter() - start, describe_resident_memory()))
+
+    @staticmethod
+    def _load_embedding(path, mmap):
+        """Load the embedding at 'path' and return it together with the time loading took in seconds."""
+        start = time.perf_counter()
+        try:
+            # load the word vectors of an embedding
+            emb = WordEmbedding(path, mmap=mmap)
+        except Exception as e:
+            raise EmbeddingError("Failed to load the trained embedding {}: {}".format(path, e)) from e
+        seconds = time.perf_counter() - start
+        print("...loaded {} in {:.1f}s.".format(path, seconds))
+        return emb, seconds
 
     def shared_vocab(self):
         """Return the subset of the vocab that is shared by all embeddings in the list_of_embeddings
@@ -835,226 +1183,179 @@ class EmbeddingEnsemble:
             base_df['Word2_freq'] = [self.frequency_in_training_data(word) for word in base_df['Word2']]
         return base_df
 
-    def projections_to_bipolar_dimensions(self, test, dimensions, normalize_before=True):
-        """ Same as the embedding method with the same name, but produces an average of the projections of each ensemble.
+    def stacked_vectors(self, list_of_words):
+        """Return the vectors of the words in all embeddings of the ensemble at once.
+
+        Args:
+            list_of_words (list[str]): list of words
+
+        Returns:
+            ndarray of shape (n_embeddings, n_words, dim) whose entries are zero for words missing from an
+            embedding, and boolean ndarray of shape (n_embeddings, n_words) that is True where the word is in
+            the vocab of the embedding
         """
-        if isinstance(test, str):
-            test_words = [test]
-        else:
-            test_words = test
-
-        # make dimension for each embedding, with only words found in its vocab ===========
-        processed_dims = {}
-        for dim_name, dim_words in dimensions.items():
-
-            if len(dim_words) != 2 and not (isinstance(dim_words[0], list) and isinstance(dim_words[1], list)):
-                raise ValueError("Generating words must be a list of exactly two lists that contain words.")
-
-            processed_dims[dim_name] = {}
-
-            for idx, emb in enumerate(self.list_of_embeddings):
-
-                # LEFT ======================
-                # check which dim words cannot be used in this embedding
-                left_dim_words_in_emb = []
-                left_dim_words_not_in_emb = []
-                for dim_word in dim_words[0]:
-                    if emb.in_vocab(dim_word):
-                        left_dim_words_in_emb.append(dim_word)
-                    else:
-                        left_dim_words_not_in_emb.append(dim_word)
-
-                if not left_dim_words_in_emb:
-                    print(
-                        "INFO: None of the left generating words to construct dimension {} found in embedding no {};"
-                        "this embedding is not used to compute the ensemble projection for "
-                        "this dimension.".format(dim_name, idx))
-                    continue
-
-                if left_dim_words_not_in_emb:
-                    print("INFO: Left generating word(s) {} not found in vocab of embedding no {}; "
-                          "word(s) will not be used to construct the dimension in this "
-                          "embedding.".format(left_dim_words_not_in_emb, idx))
-
-                # RIGHT ======================
-                # check which dim words cannot be used in this embedding
-                right_dim_words_in_emb = []
-                right_dim_words_not_in_emb = []
-                for dim_word in dim_words[1]:
-                    if emb.in_vocab(dim_word):
-                        right_dim_words_in_emb.append(dim_word)
-                    else:
-                        right_dim_words_not_in_emb.append(dim_word)
-
-                if not right_dim_words_in_emb:
-                    print(
-                        "INFO: None of the right generating words to construct dimension {} found in embedding no {};"
-                        "this embedding is not used to compute the ensemble projection for "
-                        "this dimension.".format(dim_name, idx))
-                    continue
-
-                if right_dim_words_not_in_emb:
-                    print("INFO: Right generating word(s) {} not found in vocab of embedding no {}; "
-                          "word(s) will not be used to construct the dimension in this "
-                          "embedding.".format(right_dim_words_not_in_emb, idx))
-
-                processed_dims[dim_name][idx] = [left_dim_words_in_emb, right_dim_words_in_emb]
-
-        # ===============
-
-        data = []
-        for test_word in test_words:
-
-            row = [test_word]
-            cols = ["test_word"]
-
-            # get indices of embeddings have test word in vocab
-            emb_idx = []
-            for idx, emb in enumerate(self.list_of_embeddings):
-                if emb.in_vocab(test_word):
-                    emb_idx.append(idx)
-
-            # kick test word out if it is in no embedding
-            if not emb_idx:
+        list_of_words = list(list_of_words)
+        dim = self.list_of_embeddings[0].vectors([]).shape[1]
+
+        stack = np.zeros((len(self.list_of_embeddings), len(list_of_words), dim), dtype=np.float32)
+        mask = np.zeros((len(self.list_of_embeddings), len(list_of_words)), dtype=bool)
+        for idx, emb in enumerate(self.list_of_embeddings):
+            mask[idx] = emb.in_vocab_many(list_of_words)
+            stack[idx, mask[idx]] = emb.vectors([word for word, found in zip(list_of_words, mask[idx]) if found])
+        return stack, mask
+
+    def _stacked_projections(self, test, dimensions, normalize_before, normalize_centroids=False):
+        """Project the test words onto the dimensions in all embeddings with one batched matrix product,
+        and return a data frame with the mean and standard deviation over the embeddings."""
+        test_words = [test] if isinstance(test, str) else list(test)
+
+        test_vecs, test_mask = self.stacked_vectors(test_words)
+
+        for word, mask in zip(test_words, test_mask.T):
+            if not mask.any():
+                # kick test word out if it is in no embedding
                 print("INFO: Test word {} is not in vocab of any embedding in the ensemble "
-                      "and has been removed from the list of results.".format(test_word))
-                continue
-
-            # notify user which embeddings are used
-            not_in = set(range(len(self.list_of_embeddings))) - set(emb_idx)
-            if not_in:
+                      "and has been removed from the list of results.".format(word))
+            elif not mask.all():
+                # notify user which embeddings are used
                 print("INFO: Test word {} not found in vocab of embedding number(s) {}; "
                       "embedding(s) will not be used to compute the projection "
-                      "of the test word.".format(test_word, not_in))
+                      "of the test word.".format(word, set(np.flatnonzero(~mask).tolist())))
 
-            # =========================================
+        dim_vecs, dim_valid = dimensions.stacked_basis(self, normalize_before=normalize_before,
+                                                       normalize_centroids=normalize_centroids)
 
-            for dim_name, dim_dict in dimensions.items():
+        # shape (n_embeddings, n_test_words, n_dimensions)
+        projections = np.matmul(test_vecs, dim_vecs.transpose(0, 2, 1))
+        projections[~(test_mask[:, :, np.newaxis] & dim_valid[:, np.newaxis, :])] = np.nan
 
-                results = []
-                for idx in emb_idx:
-                    if idx in processed_dims[dim_name]:
+        with warnings.catch_warnings():
+            # dimensions that no embedding can represent for a test word get a nan entry
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            means = np.nanmean(projections, axis=0)
+            stds = np.nanstd(projections, axis=0)
 
-                        emb = self.list_of_embeddings[idx]
-                        test_vec = emb.vector(test_word)
-                        centroid_left = emb.centroid_of_vectors(processed_dims[dim_name][idx][0])
-                        centroid_right = emb.centroid_of_vectors(processed_dims[dim_name][idx][1])
-                        diff = centroid_left - centroid_right
-
-                        if normalize_before:
-                            diff = normalize_vector(diff)
-
-                        res = np.dot(test_vec, diff)
-                        results.append(res)
-
-                row.extend([np.mean(results), np.std(results)])
-
-            data.append(row)
-
-        # make correct col names
-        for dim in list(dimensions):
+        cols = ["test_word"]
+        data = {"test_word": test_words}
+        for idx, dim in enumerate(dimensions.names()):
             cols.extend([dim, dim + "(std)"])
+            data[dim] = means[:, idx]
+            data[dim + "(std)"] = stds[:, idx]
 
         df = pd.DataFrame(data, columns=cols)
+        df = df[test_mask.any(axis=0)]
         df = df.sort_values(cols[1:], axis=0, ascending=False)
         return df
 
-    def projections_to_unipolar_dimensions(self, test, dimensions, normalize_before=True):
-        """Same as the embedding method with the same name, but produces an average of the projections of each ensemble.
-        """
-        if isinstance(test, str):
-            test_words = [test]
-        else:
-            test_words = test
-
-        # make dimension for each embedding, with only words found in its vocab ===========
-        processed_dims = {}
-        for dim_name, dim_words in dimensions.items():
-
-            if len(np.array(dim_words).shape) != 1:
-                raise ValueError("Generating words must be a list of words.")
-
-            processed_dims[dim_name] = {}
-
-            for idx, emb in enumerate(self.list_of_embeddings):
-
-                # check which dim words cannot be used in this embedding
-                dim_words_in_emb = []
-                dim_words_not_in_emb = []
-                for dim_word in dim_words[0]:
-                    if emb.in_vocab(dim_word):
-                        dim_words_in_emb.append(dim_word)
-                    else:
-                        dim_words_not_in_emb.append(dim_word)
-
-                if not dim_words_in_emb:
-                    print(
-                        "INFO: None of the generating words to construct dimension {} found in embedding no {};"
-                        "this embedding is not used to compute the ensemble projection for "
-                        "this dimension.".format(dim_name, idx))
-                    continue
-
-                if dim_words_not_in_emb:
-                    print("INFO: Generating word(s) {} not found in vocab of embedding no {}; "
-                          "word(s) will not be used to construct the dimension in this "
-                          "embedding.".format(dim_words_not_in_emb, idx))
-
-
-                processed_dims[dim_name][idx] = dim_words_in_emb
-
-        # ===============
-
-        data = []
-        for test_word in test_words:
-
-            row = [test_word]
-            cols = ["test_word"]
-
-            # get indices of embeddings have test word in vocab
-            emb_idx = []
-            for idx, emb in enumerate(self.list_of_embeddings):
-                if emb.in_vocab(test_word):
-                    emb_idx.append(idx)
-
-            # kick test word out if it is in no embedding
-            if not emb_idx:
-                print("INFO: Test word {} is not in vocab of any embedding in the ensemble "
-                      "and has been removed from the list of results.".format(test_word))
-                continue
-
-            # notify user which embeddings are used
-            not_in = set(range(len(self.list_of_embeddings))) - set(emb_idx)
-            if not_in:
-                print("INFO: Test word {} not found in vocab of embedding number(s) {}; "
-                      "embedding(s) will not be used to compute the projection "
-                      "of the test word.".format(test_word, not_in))
-
-            # =========================================
-
-            for dim_name, dim_dict in processed_dims.items():
-
-                results = []
-                for idx in emb_idx:
-                    if idx in processed_dims[dim_name]:
-
-                        emb = self.list_of_embeddings[idx]
-                        test_vec = emb.vector(test_word)
-                        centroid = emb.centroid_of_vectors(processed_dims[dim_name][idx])
-
-                        if normalize_before:
-                            centroid = normalize_vector(centroid)
-                        res = np.dot(test_vec, centroid)
-                        results.append(res)
+    def projections_to_bipolar_dimensions(self, test, dimensions, normalize_before=True):
+        """ Same as the embedding method with the same name, but produces an average of the projections of each ensemble.
 
-                row.extend([np.mean(results), np.std(results)])
+        The embeddings are stacked into one array, so that the projections of all test words in all embeddings are
+        computed in one batched operation. Generating words and test words that are missing from an embedding are
+        masked out for that embedding.
+        """
+        dimensions = DimensionSet.make(dimensions, bipolar=True)
+        return self._stacked_projections(test, dimensions, normalize_before=normalize_before)
 
-            data.append(row)
+    def projections_to_unipolar_dimensions(self, test, dimensions, normalize_before=True):
+        """Same as the embedding method with the same name, but produces an average of the projections of each ensemble.
 
-        # make correct col names
-        for dim in list(dimensions):
-            cols.extend([dim, dim + "(std)"])
+        See projections_to_bipolar_dimensions() for how the projections are computed.
+        """
+        dimensions = DimensionSet.make(dimensions, bipolar=False)
+        return self._stacked_projections(test, dimensions, normalize_before=normalize_before)
+
+    def shared_rows(self):
+        """Return the shared vocab, in the order of the first embedding, and an array of shape
+        (n_embeddings, n_shared_words) with the row of each shared word in the matrix of each embedding."""
+        if self._shared_rows is None:
+            first = self.list_of_embeddings[0]
+            others = self.list_of_embeddings[1:]
+            words = [word for word in first._word_vectors.index2word if all(emb.in_vocab(word) for emb in others)]
+            rows = np.array([[emb._index[word] for word in words] for emb in self.list_of_embeddings],
+                            dtype=np.int64).reshape(len(self.list_of_embeddings), len(words))
+            self._shared_rows = words, rows
+        return self._shared_rows
+
+    def most_similar(self, words, n=10, max_elements=MAX_CHUNK_ELEMENTS):
+        """Return the nearest neighbours of each query word in all embeddings, and how stable they are.
+
+        The neighbours are searched in the shared vocab only, so that the neighbourhoods of different embeddings
+        can be compared. The query vectors of all embeddings are stacked and scored against chunks of the stacked
+        shared-vocab matrices with one batched matrix product per chunk, so the vocab is scanned once for all
+        queries and embeddings. At most 'max_elements' similarities are held at a time.
 
-        df = pd.DataFrame(data, columns=cols)
-        df = df.sort_values(cols[1:], axis=0, ascending=False)
-        return df
+        Args:
+            words (str or list[str]): query words
+            n (int): number of neighbours per embedding
+            max_elements (int): maximum number of similarities computed at a time
 
+        Returns:
+            dict that maps each query word to a DataFrame of the union of its neighbours in all embeddings, with the
+            number of embeddings in which the neighbour is among the n nearest (Frequency) and the mean and std of
+            its similarity to the query word over all embeddings; and a DataFrame with the mean and std of the
+            Jaccard overlap of the neighbour sets of all pairs of embeddings for each query word
+        """
+        words = [words] if isinstance(words, str) else list(words)
+        shared_words, rows = self.shared_rows()
+        position = {word: pos for pos, word in enumerate(shared_words)}
+
+        queries = []
+        for word in words:
+            if word in position:
+                queries.append(word)
+            else:
+                print("INFO: Query word {} is not in the shared vocab of the ensemble "
+                      "and has been removed from the list of results.".format(word))
+
+        embs = self.list_of_embeddings
+        n_embs, n_queries, n_words = len(embs), len(queries), len(shared_words)
+        query_pos = np.array([position[word] for word in queries], dtype=np.int64)
+        dim = embs[0].vectors([]).shape[1]
+
+        # shape (n_embeddings, n_queries, dim)
+        query_vecs = np.stack([emb._matrix[rows[idx, query_pos]] for idx, emb in enumerate(embs)])
+        query_vecs = query_vecs.reshape(n_embs, n_queries, dim)
+
+        k = min(n, n_words - 1)
+        candidates = []
+        if n_queries > 0 and k > 0:
+            chunk_size = max(1, max_elements // (n_embs * n_queries))
+            for start in range(0, n_words, chunk_size):
+                block = np.stack([emb._matrix[rows[idx, start:start + chunk_size]] for idx, emb in enumerate(embs)])
+                sims = np.matmul(query_vecs, block.transpose(0, 2, 1))
+
+                # a query word is not its own neighbour
+                in_chunk = np.flatnonzero((query_pos >= start) & (query_pos < start + block.shape[1]))
+                sims[:, in_chunk, query_pos[in_chunk] - start] = -np.inf
+
+                candidates.append(select_candidates(sims.reshape(n_embs * n_queries, -1), k, start))
+            # neighbours of query j in embedding i are at position i * n_queries + j
+            nearest = [pos for pos, _ in merge_candidates(candidates, n_embs * n_queries, k)]
+        else:
+            nearest = [np.zeros(0, dtype=np.int64)] * (n_embs * n_queries)
+
+        neighbours = {}
+        stability = []
+        for j, word in enumerate(queries):
+            sets = [nearest[i * n_queries + j] for i in range(n_embs)]
+            union, frequency = np.unique(np.concatenate(sets), return_counts=True)
+
+            # similarities of all neighbours in all embeddings, shape (n_embeddings, n_union)
+            union_sims = np.stack([emb._matrix[rows[i, union]] @ query_vecs[i, j] for i, emb in enumerate(embs)])
+            union_sims = union_sims.reshape(n_embs, len(union))
+
+            df = pd.DataFrame({"Neighbour": [shared_words[pos] for pos in union.tolist()],
+                               "Frequency": frequency, "MEAN": union_sims.mean(axis=0),
+                               "STD": union_sims.std(axis=0)}, columns=["Neighbour", "Frequency", "MEAN", "STD"])
+            neighbours[word] = df.sort_values(["Frequency", "MEAN"], axis=0, ascending=False).reset_index(drop=True)
+
+            sets = [set(s.tolist()) for s in sets]
+            jaccards = [len(a & b) / len(a | b) if a | b else 1.0 for a, b in combinations(sets, 2)]
+            if not jaccards:
+                # a single embedding is trivially stable
+                jaccards = [1.0]
+            stability.append([word, np.mean(jaccards), np.std(jaccards)])
+
+        stability = pd.DataFrame(stability, columns=["Word", "Jaccard", "Jaccard(std)"])
+        return neighbours, stability
@@ -0,0 +1,317 @@
+# This file contains exact and approximate nearest neighbour search over the normalized vector matrix of an embedding
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+# maximum number of similarities held in memory at a time; the vocab is processed in chunks below this bound
+MAX_CHUNK_ELEMENTS = 2**24
+
+# default number of clusters an approximate search looks into
+N_PROBE = 8
+
+
+def query_vector(matrix, index, positive=(), negative=()):
+    """Combine words and vectors into one query vector, the way gensim's most_similar() does.
+
+    Every word or vector gets a weight of 1 if it is positive and -1 if it is negative, unless it is given as a
+    (word_or_vector, weight) pair. Words are replaced by their rows in 'matrix', vectors are taken as they are, and
+    the query is the normalized mean of the weighted vectors.
+
+    Args:
+        matrix (ndarray): matrix of normalized word vectors
+        index (dict): maps each word to its row in 'matrix'
+        positive (list): words or vectors the neighbours should be similar to
+        negative (list): words or vectors the neighbours should be dissimilar to
+
+    Returns:
+        ndarray of shape (dim,), list of the rows of the words, which are excluded from the neighbours
+    """
+    positive = [(item, 1.0) if isinstance(item, (str, np.ndarray)) else item for item in positive]
+    negative = [(item, -1.0) if isinstance(item, (str, np.ndarray)) else item for item in negative]
+
+    vecs = []
+    rows = []
+    for item, weight in positive + negative:
+        if isinstance(item, np.ndarray):
+            vecs.append(weight * item)
+        else:
+            if item not in index:
+                raise KeyError("word '{}' not in vocabulary".format(item))
+            rows.append(index[item])
+            vecs.append(weight * matrix[index[item]])
+    if not vecs:
+        raise ValueError("cannot compute similarity with no input")
+
+    mean = np.array(vecs).mean(axis=0)
+    norm = np.linalg.norm(mean)
+    if norm > 0:
+        mean = mean / norm
+    return mean.astype(matrix.dtype), sorted(set(rows))
+
+
+def top_k(matrix, queries, k, exclude=None, largest=True, max_elements=MAX_CHUNK_ELEMENTS):
+    """Find the rows of 'matrix' with the largest (or smallest) dot products with each query.
+
+    The vocab is processed in chunks of rows, so that at most 'max_elements' similarities are held at a time. In
+    each chunk, np.partition() finds the k-th best similarity of every query, and only the rows at least as good
+    are kept as candidates. Ties are broken by row, so the result does not depend on the chunking.
+
+    Args:
+        matrix (ndarray): matrix of shape (n, dim)
+        queries (ndarray): matrix of shape (n_queries, dim)
+        k (int): number of neighbours per query
+        exclude (list): for each query, a list of rows that are never returned, or None
+        largest (bool): if True, return the most similar rows, else the least similar ones
+        max_elements (int): maximum number of similarities computed at a time
+
+    Returns:
+        list with an array of rows and an array of their similarities for each query, best first
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=matrix.dtype))
+    n_queries = len(queries)
+    n_rows = len(matrix)
+    k = min(k, n_rows)
+    if k <= 0 or n_queries == 0:
+        return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=matrix.dtype)) for _ in range(n_queries)]
+
+    if exclude is None:
+        exclude = [[] for _ in range(n_queries)]
+    exclude_query = np.repeat(np.arange(n_queries), [len(rows) for rows in exclude])
+    exclude_row = np.array([row for rows in exclude for row in rows], dtype=np.int64)
+
+    chunk_size = max(1, max_elements // n_queries)
+    sign = 1 if largest else -1
+    candidates = []
+    for start in range(0, n_rows, chunk_size):
+        # higher keys are better
+        keys = sign * (queries @ matrix[start:start + chunk_size].T)
+
+        in_chunk = (exclude_row >= start) & (exclude_row < start + keys.shape[1])
+        keys[exclude_query[in_chunk], exclude_row[in_chunk] - start] = -np.inf
+        candidates.append(select_candidates(keys, k, start))
+
+    return [(rows, sign * keys) for rows, keys in merge_candidates(candidates, n_queries, k)]
+
+
+def select_candidates(keys, k, start):
+    """Return the candidates for the k best rows of each query in a chunk of keys, where higher keys are better.
+
+    np.partition() finds the k-th best key of every query, and all rows at least as good are kept, so that ties at
+    the k-th place are resolved later by merge_candidates(). Keys of -inf mark excluded rows.
+
+    Args:
+        keys (ndarray): keys of shape (n_queries, chunk_size)
+        k (int): number of rows per query
+        start (int): row of the first column of the chunk
+
+    Returns:
+        arrays of the query, row and key of each candidate
+    """
+    kk = min(k, keys.shape[1])
+    kth = np.partition(keys, keys.shape[1] - kk, axis=1)[:, keys.shape[1] - kk]
+    query, col = np.nonzero((keys >= kth[:, np.newaxis]) & (keys > -np.inf))
+    return query, col + start, keys[query, col]
+
+
+def merge_candidates(candidates, n_queries, k):
+    """Merge the candidates of all chunks, see select_candidates(), into the k best rows of each query.
+
+    Returns:
+        list with an array of rows and an array of their keys for each query, best first, ties broken by row
+    """
+    cand_query = np.concatenate([query for query, _, _ in candidates])
+    cand_row = np.concatenate([row for _, row, _ in candidates])
+    cand_key = np.concatenate([key for _, _, key in candidates])
+
+    # order by query, then best key, then row
+    order = np.lexsort((cand_row, -cand_key, cand_query))
+    cand_query, cand_row, cand_key = cand_query[order], cand_row[order], cand_key[order]
+
+    bounds = np.searchsorted(cand_query, np.arange(n_queries + 1))
+    return [(cand_row[lo:min(hi, lo + k)], cand_key[lo:min(hi, lo + k)]) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def vocab_fingerprint(words):
+    """Return a string that identifies the list of words of a vector matrix, made of their number and a hash of the
+    words in order, so that an index can be checked against the matrix it is used with."""
+    digest = hashlib.sha1("\n".join(words).encode("utf8")).hexdigest()
+    return "{}:{}".format(len(words), digest)
+
+
+def _best_rows(scores, rows, k):
+    """Return the k rows with the highest scores, ties broken by row, and their scores."""
+    order = np.lexsort((rows, -scores))[:k]
+    return rows[order], scores[order]
+
+
+class IVFIndex:
+    """An inverted file index for approximate nearest neighbour search with normalized vectors.
+
+    Spherical k-means splits the vectors into 'n_lists' clusters. A query is only compared with the vectors of
+    the 'n_probe' clusters whose centroids are most similar to it, which makes a query cost roughly
+    n_probe / n_lists of an exact search. More probes give a higher recall at a higher cost.
+
+    The index is saved as a directory that contains the files 'centroids.npy' (the normalized centroids),
+    'rows.npy' (the rows of the matrix, grouped by cluster) and 'starts.npy' (where the rows of each cluster start
+    in 'rows.npy', plus the total length), and 'fingerprint.txt' (the vocab_fingerprint() of the words of the matrix,
+    if known). The directory is written under a temporary name and moved into place once it is complete, so a reader
+    never maps a partial index. Loading memory-maps the arrays.
+    """
+
+    CENTROIDS_FILE = "centroids.npy"
+    ROWS_FILE = "rows.npy"
+    STARTS_FILE = "starts.npy"
+    FINGERPRINT_FILE = "fingerprint.txt"
+
+    def __init__(self, centroids, rows, starts, fingerprint=None):
+        """
+        Args:
+            centroids (ndarray): normalized cluster centroids of shape (n_lists, dim)
+            rows (ndarray): matrix rows, grouped by cluster
+            starts (ndarray): the rows of cluster i are rows[starts[i]:starts[i+1]]
+            fingerprint (str): vocab_fingerprint() of the words of the matrix the index was built from, if known
+        """
+        self.centroids = centroids
+        self.rows = rows
+        self.starts = starts
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    @staticmethod
+    def _assign(matrix, centroids, max_elements=MAX_CHUNK_ELEMENTS):
+        """Return the index of the most similar centroid of each row of 'matrix', computed in chunks."""
+        chunk_size = max(1, max_elements // len(centroids))
+        labels = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), chunk_size):
+            labels[start:start + chunk_size] = np.argmax(matrix[start:start + chunk_size] @ centroids.T, axis=1)
+        return labels
+
+    @classmethod
+    def build(cls, matrix, n_lists=None, n_iter=10, sample_size=None, seed=0, fingerprint=None):
+        """Cluster the normalized rows of 'matrix' with spherical k-means and index them.
+
+        Args:
+            matrix (ndarray): matrix of normalized vectors of shape (n, dim)
+            n_lists (int): number of clusters, defaults to the square root of n
+            n_iter (int): number of k-means iterations
+            sample_size (int): number of rows the centroids are fitted on, defaults to 256 per cluster
+            seed (int): seed of the random initialisation and sample
+            fingerprint (str): vocab_fingerprint() of the words of the matrix, saved with the index
+
+        Returns:
+            IVFIndex
+        """
+        n_rows = len(matrix)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n_rows)))
+        n_lists = max(1, min(n_lists, n_rows))
+        if sample_size is None:
+            sample_size = 256 * n_lists
+
+        rng = np.random.RandomState(seed)
+        sample = matrix[np.sort(rng.choice(n_rows, size=min(sample_size, n_rows), replace=False))]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].astype(np.float32)
+
+        for _ in range(n_iter):
+            labels = cls._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1)
+
+            # clusters that lost all their vectors are moved to random vectors of the sample
+            empty = norms == 0
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+            centroids = (sums / np.maximum(norms, np.finfo(np.float32).tiny)[:, np.newaxis]).astype(np.float32)
+
+        labels = cls._assign(matrix, centroids)
+        rows = np.argsort(labels, kind="stable").astype(np.int64)
+        starts = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=starts[1:])
+        return cls(centroids, rows, starts, fingerprint=fingerprint)
+
+    @staticmethod
+    def exists(path):
+        """Return whether an index was saved in the directory 'path'."""
+        return os.path.isfile(os.path.join(path, IVFIndex.CENTROIDS_FILE))
+
+    def save(self, path):
+        """Save the index in the directory 'path', replacing an index saved there before.
+
+        The files are written to a temporary directory next to 'path', which is then renamed to 'path'. If another
+        process moved its own index into place in the meantime, that index is kept.
+        """
+        path = os.path.abspath(path)
+        tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + ".tmp", dir=os.path.dirname(path))
+        old_path = tmp_path + ".old"
+        try:
+            np.save(os.path.join(tmp_path, self.CENTROIDS_FILE), self.centroids)
+            np.save(os.path.join(tmp_path, self.ROWS_FILE), self.rows)
+            np.save(os.path.join(tmp_path, self.STARTS_FILE), self.starts)
+            if self.fingerprint is not None:
+                with open(os.path.join(tmp_path, self.FINGERPRINT_FILE), "w", encoding="utf8") as f:
+                    f.write(self.fingerprint)
+
+            # a directory cannot replace a non-empty one, so an old index is moved aside first; readers that
+            # memory-mapped its files keep them
+            if os.path.isdir(path):
+                try:
+                    os.replace(path, old_path)
+                except OSError:
+                    pass
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                if not IVFIndex.exists(path):
+                    raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load the index saved in the directory 'path', memory-mapped if 'mmap' is True."""
+        mmap_mode = "r" if mmap else None
+        fingerprint = None
+        fingerprint_path = os.path.join(path, cls.FINGERPRINT_FILE)
+        if os.path.isfile(fingerprint_path):
+            with open(fingerprint_path, "r", encoding="utf8") as f:
+                fingerprint = f.read()
+        return cls(np.load(os.path.join(path, cls.CENTROIDS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, cls.ROWS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, cls.STARTS_FILE), mmap_mode=mmap_mode),
+                   fingerprint=fingerprint)
+
+    def search(self, matrix, queries, k, exclude=None, n_probe=N_PROBE):
+        """Find approximately the rows of 'matrix' with the largest dot products with each query.
+
+        Args:
+            matrix (ndarray): the matrix the index was built from
+            queries (ndarray): matrix of shape (n_queries, dim)
+            k (int): number of neighbours per query
+            exclude (list): for each query, a list of rows that are never returned, or None
+            n_probe (int): number of clusters searched per query
+
+        Returns:
+            list with an array of rows and an array of their similarities for each query, best first, like top_k()
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=matrix.dtype))
+        n_probe = max(1, min(n_probe, len(self.centroids)))
+        if exclude is None:
+            exclude = [[] for _ in range(len(queries))]
+
+        # the n_probe most similar clusters of each query
+        centroid_sims = queries @ np.asarray(self.centroids).T
+        probes = np.argpartition(-centroid_sims, n_probe - 1, axis=1)[:, :n_probe]
+
+        results = []
+        for query, probe, excluded in zip(queries, probes, exclude):
+            rows = np.concatenate([self.rows[self.starts[c]:self.starts[c + 1]] for c in np.sort(probe)])
+            if len(excluded):
+                rows = rows[~np.isin(rows, excluded)]
+            results.append(_best_rows(matrix[rows] @ query, rows, k))
+        return results
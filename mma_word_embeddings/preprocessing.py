@@ -0,0 +1,218 @@
+# This file contains the functions that clean raw text into lists of tokens for training
+import re
+import sys
+import time
+import string
+from collections import deque
+from itertools import islice
+from functools import partial, lru_cache
+from multiprocessing import Pool
+import nltk
+from nltk.corpus import stopwords
+from bs4 import BeautifulSoup
+from mma_word_embeddings.reader import chunked
+
+
+nltk.download('stopwords')
+nltk.download('wordnet')
+stop = stopwords.words('english')
+
+CUSTOM_STOPWORDS = []
+STOPWORD_EXCEPTIONS = ['he', 'she', 'him', 'her', 'his', 'hers']
+PUNCTUATION = string.punctuation + "“”’‘‚…"  # add some symbols that have different ascii
+GARBAGE = ['windowtextcolor', ]
+
+# stopwords that are removed, as a set for constant-time lookups
+REMOVED_STOPWORDS = frozenset(stop) - frozenset(STOPWORD_EXCEPTIONS)
+
+# maximum number of distinct words whose lemma is cached per process
+LEMMA_CACHE_SIZE = 2**18
+
+# the lemmatizer loads wordnet on first use, so creating it at import is cheap
+lemmatizer = nltk.WordNetLemmatizer()
+
+# number of documents cleaned per chunk, and between two progress reports
+CHUNK_SIZE = 1000
+
+# words that have single upper case letters surrounded by lower case letters (javascript)
+CAMEL_CASE = re.compile(r'\b[a-z]+(?:[A-Z][a-z]+)+\b')
+
+# translate table that deletes punctuation and digits, built on first use
+_DELETE_TABLE = None
+
+
+def _delete_table():
+    """Return the translate table that deletes all punctuation and every character for which str.isdigit() is
+    true (including non-ascii digits like '²'), so that it removes exactly what a per-character check would."""
+    global _DELETE_TABLE
+    if _DELETE_TABLE is None:
+        table = {ord(char): None for char in PUNCTUATION}
+        table.update({code: None for code in range(sys.maxunicode + 1) if chr(code).isdigit()})
+        _DELETE_TABLE = table
+    return _DELETE_TABLE
+
+
+def _strip_html(text):
+    """Remove html formatting. Text without tags or character references is returned as it is, which is what
+    BeautifulSoup would return, without constructing a parser."""
+    if '<' in text or '&' in text:
+        return BeautifulSoup(text, "html.parser").text
+    return text
+
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemma_of(word):
+    """Return the lemma of 'word'. Lemmas are cached, since the frequent words of a corpus make up most of
+    its tokens."""
+    return lemmatizer.lemmatize(word)
+
+
+def print_progress(n_done, n_total):
+    """Default progress callback of clean_documents()."""
+    print("...cleaned first ", n_done, " documents...")
+
+
+def clean_document(document, remove_stopwords=False, lemmatize=False):
+    """Clean a raw document and split it into sentences, which are lists of words.
+
+    Javascript and html are removed from the whole document at once before it is split into sentences at every
+    ".". This gives the same words as cleaning each sentence separately, except for html tags that contain a "."
+    (like links), which splitting first used to break apart.
+
+    Args:
+        document (str): raw document
+        remove_stopwords (bool): If true, remove standard stop words.
+        lemmatize (bool): If true, replace words by their stems
+
+    Returns:
+        list[list[str]]
+    """
+    document = CAMEL_CASE.sub('', document)
+    document = _strip_html(document)
+    return [_clean_words(sentence, remove_stopwords, lemmatize) for sentence in document.split(".")]
+
+
+def _clean_words(sentence, remove_stopwords, lemmatize):
+    """Split a sentence that is free of html into a list of clean words."""
+
+    sentence = sentence.replace(r'\xad', '')
+
+    sentence = sentence.replace('displayad', '')
+
+    sentence = sentence.translate(_delete_table())
+
+    # split string into list of words separated by whitespace
+    sentence = sentence.split()
+
+    sentence = [word for word in sentence if all(g not in word for g in GARBAGE)]
+
+    if remove_stopwords:
+        sentence = [word for word in sentence if word not in REMOVED_STOPWORDS]
+
+    sentence = [word.lower() for word in sentence]
+
+    if lemmatize:
+        sentence = [lemma_of(word) for word in sentence]
+
+    return sentence
+
+
+def _clean_chunk(documents, remove_stopwords, lemmatize):
+    """Clean a chunk of documents, used by the worker processes of clean_documents()."""
+    return [clean_document(document, remove_stopwords=remove_stopwords, lemmatize=lemmatize)
+            for document in documents]
+
+
+def iter_clean_chunks(documents, remove_stopwords=False, lemmatize=False, n_jobs=1, chunk_size=CHUNK_SIZE):
+    """Clean an iterable of raw documents chunk by chunk, optionally in parallel.
+
+    The documents are read lazily, so they can be streamed from disk. With 'n_jobs' > 1, at most two chunks per
+    process are in flight at any time, which bounds the memory used for raw documents.
+
+    Args:
+        documents (iterable of str): raw documents
+        remove_stopwords (bool): If true, remove standard stop words.
+        lemmatize (bool): If true, replace words by their stems
+        n_jobs (int): number of processes
+        chunk_size (int): number of documents per chunk
+
+    Returns:
+        generator that yields the number of documents and the list of cleaned sentences of each chunk, in the
+        order of the input
+    """
+    clean_chunk = partial(_clean_chunk, remove_stopwords=remove_stopwords, lemmatize=lemmatize)
+
+    if n_jobs <= 1:
+        for chunk in chunked(documents, chunk_size):
+            yield len(chunk), [sentence for sentences in clean_chunk(chunk) for sentence in sentences]
+        return
+
+    def collect(result):
+        n_documents, cleaned_chunk = result
+        return n_documents, [sentence for sentences in cleaned_chunk.get() for sentence in sentences]
+
+    pool = Pool(processes=n_jobs)
+    pending = deque()
+    try:
+        for chunk in chunked(documents, chunk_size):
+            pending.append((len(chunk), pool.apply_async(clean_chunk, (chunk,))))
+            if len(pending) >= 2 * n_jobs:
+                yield collect(pending.popleft())
+        while pending:
+            yield collect(pending.popleft())
+    finally:
+        pool.close()
+        pool.join()
+
+
+def clean_documents(documents, remove_stopwords=False, lemmatize=False, n_jobs=1, chunk_size=CHUNK_SIZE,
+                    progress=print_progress, skip=0, sink=None):
+    """Clean raw documents into one list of sentences, optionally in parallel.
+
+    The documents are split into chunks that are cleaned by a pool of 'n_jobs' processes. The cleaned sentences
+    are returned in the order of the input, whatever the number of processes.
+
+    Args:
+        documents (iterable of str): raw documents, a list or a stream
+        remove_stopwords (bool): If true, remove standard stop words.
+        lemmatize (bool): If true, replace words by their stems
+        n_jobs (int): number of processes
+        chunk_size (int): number of documents per chunk
+        progress (callable): called as progress(n_done, n_total) with the number of cleaned documents after
+            every chunk, or None; n_total is None if 'documents' has no length
+        skip (int): number of documents at the start of 'documents' that were cleaned before and are skipped;
+            they count as done for the progress, but not for the returned statistics
+        sink (callable): if given, called as sink(n_documents, sentences) for every cleaned chunk instead of
+            collecting the sentences, for example PreprocessingCheckpoint.add_chunk
+
+    Returns:
+        list[list[str]] (None if a sink is given), dict with the number of documents and sentences, the seconds it
+        took and the sentences per second
+    """
+
+    start = time.perf_counter()
+    n_total = len(documents) if hasattr(documents, "__len__") else None
+    if skip > 0:
+        documents = islice(documents, skip, None)
+
+    cleaned = [] if sink is None else None
+    n_done = skip
+    n_sentences = 0
+    if progress is not None:
+        progress(n_done, n_total)
+
+    for n_documents, sentences in iter_clean_chunks(documents, remove_stopwords=remove_stopwords,
+                                                    lemmatize=lemmatize, n_jobs=n_jobs, chunk_size=chunk_size):
+        if sink is None:
+            cleaned.extend(sentences)
+        else:
+            sink(n_documents, sentences)
+        n_done += n_documents
+        n_sentences += len(sentences)
+        if progress is not None:
+            progress(n_done, n_total)
+
+    seconds = time.perf_counter() - start
+    stats = {"documents": n_done - skip, "sentences": n_sentences, "seconds": seconds,
+             "sentences_per_second": n_sentences / seconds if seconds > 0 else float("inf")}
+    return cleaned, stats
@@ -0,0 +1,146 @@
+# This file contains functions that stream records from json exports without loading the whole file into memory
+import re
+import json
+from itertools import islice
+
+# number of characters read from the file at a time
+READ_BUFFER_SIZE = 2**20
+
+# characters that can continue a json number
+NUMBER_CHARS = "0123456789.eE+-"
+
+
+def read_json_array(f, buffer_size=READ_BUFFER_SIZE):
+    """Yield the elements of a json array one by one from the open text file 'f'.
+
+    The file is read in blocks of 'buffer_size' characters, and each element is decoded with
+    json.JSONDecoder.raw_decode() as soon as it is complete, so only one block and one element are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        # drop what has been decoded and append the next block
+        nonlocal buffer, pos, eof
+        block = f.read(buffer_size)
+        eof = block == ""
+        buffer = buffer[pos:] + block
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    fill()
+    skip_whitespace()
+    if buffer[pos:pos + 1] != "[":
+        raise ValueError("Expected a json array.")
+    pos += 1
+
+    first = True
+    while True:
+        skip_whitespace()
+        if pos == len(buffer):
+            raise ValueError("Unexpected end of file in json array.")
+        if buffer[pos] == "]":
+            return
+        if not first:
+            if buffer[pos] != ",":
+                raise ValueError("Expected ',' between elements of json array at character {}.".format(pos))
+            pos += 1
+            skip_whitespace()
+        first = False
+
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # a number that reaches the end of the buffer, or was cut at a '.' or exponent, may continue in the next
+            # block
+            truncated = end == len(buffer) or (isinstance(element, (int, float)) and buffer[end] in NUMBER_CHARS)
+            if truncated and not eof:
+                fill()
+                continue
+            break
+
+        pos = end
+        yield element
+
+
+def read_json_lines(f):
+    """Yield the records of the open text file 'f' in json lines format, one record per line."""
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def matches(record, filters):
+    """Return whether 'record' passes all 'filters'.
+
+    Args:
+        record (dict): the record
+        filters (dict or list): maps a column to a list of selectors, as a dict or a list of (column, selectors)
+            pairs; like DexterData.filter(), a record passes if its value for the column contains (at least one of)
+            the regular expressions
+
+    Returns:
+        bool
+    """
+    if isinstance(filters, dict):
+        filters = filters.items()
+    for column, selectors in filters:
+        value = record.get(column)
+        if not isinstance(value, str) or re.search('|'.join(selectors), value) is None:
+            return False
+    return True
+
+
+def read_records(path, columns=None, filters=None):
+    """Yield the records of a json file, which holds either one json array or json lines.
+
+    Args:
+        path (str): path to the json file
+        columns (list[str]): columns to keep; all columns are kept if None
+        filters (dict): only yield records that pass these filters, see matches()
+
+    Returns:
+        generator of dicts
+    """
+    with open(path, 'r', encoding='utf8') as f:
+        # the first character tells an array from json lines
+        first = ""
+        while True:
+            char = f.read(1)
+            if char == "" or not char.isspace():
+                first = char
+                break
+        f.seek(0)
+
+        records = read_json_array(f) if first == "[" else read_json_lines(f)
+        for record in records:
+            if filters and not matches(record, filters):
+                continue
+            if columns is not None:
+                record = {column: record.get(column) for column in columns}
+            yield record
+
+
+def chunked(iterable, size):
+    """Yield consecutive lists of at most 'size' items of 'iterable'."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -1,7 +1,37 @@
 # This file contains a wrapper class for word2vec models training word trained_embeddings
 import os
+import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from gensim.models import Word2Vec
+from mma_word_embeddings.corpus import BootstrapCorpus, LineSentenceCorpus, CorpusStore
+
+# model used by the processes that train ensemble members in parallel
+_WORKER_MODEL = None
+
+
+def _init_worker(model):
+    """Make the model available in a worker process."""
+    global _WORKER_MODEL
+    _WORKER_MODEL = model
+
+
+def _train_member(m, path, hyperparameters, n_documents, member_seed):
+    """Train one ensemble member in a worker process."""
+    _WORKER_MODEL._train_member(m, path, hyperparameters, n_documents, member_seed)
+
+
+def _save_atomically(emb, path):
+    """Save the embedding under a temporary name and move it to 'path' once it is complete, so that an
+    interrupted run never leaves a partial .emb file behind.
+
+    gensim writes large arrays to separate files '<path>.<attribute>.npy', which are moved along.
+    """
+    tmp_path = path + ".tmp"
+    emb.save(tmp_path)
+    for tmp_file in glob.glob(glob.escape(tmp_path) + ".*"):
+        os.replace(tmp_file, path + tmp_file[len(tmp_path):])
+    os.replace(tmp_path, path)
 
 
 class TrainableModel:
@@ -30,11 +60,21 @@ class TrainableModel:
               n_models=None,
               share_of_original_data=1.,
               seed=None,
+              n_jobs=1,
+              workers_per_job=None,
               ):
-        """Trains a single embedding or an ensemble of embeddings."""
+        """Trains a single embedding or an ensemble of embeddings.
 
-        if seed is not None:
-            np.random.seed(seed)
+        Args:
+            output_path (str): path prefix of the output files
+            hyperparameters (dict): hyperparameters passed to the model
+            n_models (int): if given, train an ensemble of this many models on bootstrapped data
+            share_of_original_data (float): size of each bootstrap sample relative to the training data
+            seed (int): seed from which the bootstrap sample and model seed of each ensemble member are derived
+            n_jobs (int): number of ensemble members that are trained at the same time in separate processes
+            workers_per_job (int): number of worker threads of each model trained in parallel; defaults to
+                hyperparameters["workers"] if given, else an equal share of the cores
+        """
 
         # update description already here, in case training crashes
         if n_models is not None:
@@ -57,28 +97,66 @@ class TrainableModel:
                 raise ValueError(
                     "Embedding {} already exists. Choose a different name or delete existing model.".format(
                         output_path))
-            emb.save(output_path)
+            _save_atomically(emb, output_path)
 
         else:
             # save multiple models trained on bootstrapped/subsampled data
-            for m in range(n_models):
-
-                print("Training model ", m+1)
-
-                # make bootstrapped training data
-                n_documents = int(share_of_original_data * len(self.training_data))
-                bootstrapped_train_data = list(np.random.choice(self.training_data, size=n_documents, replace=True))
-
-                # train the embedding
-                emb = self.make_embedding(bootstrapped_train_data, self.pre_training_data, hyperparameters)
-
-                # save the embedding
-                path = output_path + "-" + str(m) + ".emb"
+            paths = [output_path + "-" + str(m) + ".emb" for m in range(n_models)]
+            for path in paths:
                 if os.path.isfile(path):
                     raise ValueError(
                         "Embedding {} already exists. Choose a different name or delete existing model.".format(
                             path))
-                emb.save(path)
+
+            # bootstrap samples come out in drawn order only from a corpus with random access, so a corpus streamed
+            # from disk is encoded once into a CorpusStore, which holds the tokens as uint32 ids in memory
+            if not hasattr(self.training_data, "__getitem__"):
+                print("INFO: Encoding the training data into a CorpusStore, so that the bootstrap samples are drawn "
+                      "in random order...")
+                self.training_data = CorpusStore.from_sentences(self.training_data)
+
+            # every member gets its own seed, so the ensemble is reproducible no matter in which order
+            # or in which process the members are trained
+            seed_sequence = np.random.SeedSequence(seed)
+            member_seeds = [int(child.generate_state(1)[0]) for child in seed_sequence.spawn(n_models)]
+            n_documents = int(share_of_original_data * len(self.training_data))
+
+            if n_jobs > 1:
+                hyperparameters = dict(hyperparameters)
+                if workers_per_job is not None:
+                    hyperparameters["workers"] = workers_per_job
+                elif "workers" not in hyperparameters:
+                    hyperparameters["workers"] = max(1, (os.cpu_count() or 1) // n_jobs)
+
+                with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(self,)) as executor:
+                    futures = [executor.submit(_train_member, m, paths[m], hyperparameters, n_documents,
+                                               member_seeds[m]) for m in range(n_models)]
+                    for future in as_completed(futures):
+                        future.result()
+            else:
+                for m in range(n_models):
+                    self._train_member(m, paths[m], hyperparameters, n_documents, member_seeds[m])
+
+    def _train_member(self, m, path, hyperparameters, n_documents, member_seed):
+        """Train ensemble member 'm' on a bootstrap sample drawn with 'member_seed' and save it to 'path'."""
+
+        print("Training model ", m+1)
+
+        # make bootstrapped training data, which only stores the indices of the drawn documents
+        rng = np.random.RandomState(member_seed)
+        bootstrapped_train_data = BootstrapCorpus.sample(self.training_data, n_documents, random_state=rng)
+
+        # train the embedding
+        hyperparameters = dict(hyperparameters)
+        hyperparameters.setdefault("seed", member_seed)
+        emb = self.make_embedding(bootstrapped_train_data, self.pre_training_data, hyperparameters)
+
+        # save the embedding
+        if os.path.isfile(path):
+            raise ValueError(
+                "Embedding {} already exists. Choose a different name or delete existing model.".format(
+                    path))
+        _save_atomically(emb, path)
 
     def make_embedding(self, train_data, pre_train_data, hyperparameters):
         return NotImplemented
@@ -94,15 +172,17 @@ class Word2VecModel(TrainableModel):
         super().__init__(path_training_data, path_description, path_pretraining_data=path_pretraining_data)
 
     def _load_data(self, path):
-        data = []
-        with open(path, "r") as f:
-            for line in f:
-                stripped_line = line.strip()
-                data.append(stripped_line.split())
-        return data
+        # stream the sentences from disk instead of holding the corpus in memory
+        if CorpusStore.is_store(path):
+            return CorpusStore.load(path)
+        return LineSentenceCorpus(path)
 
     def make_embedding(self, train_data, pre_train_data, hyperparameters):
-        """Train a Word2Vec model and extract the embedding."""
+        """Train a Word2Vec model and extract the embedding.
+
+        The training and pretraining data can be any restartable iterable of token lists with a length, such as a
+        LineSentenceCorpus, since gensim iterates over them once to build the vocab and once per epoch.
+        """
 
         if pre_train_data is None:
             model = Word2Vec(train_data, **hyperparameters)
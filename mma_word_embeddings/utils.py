@@ -1,4 +1,5 @@
 # Helper functions for working with word trained_embeddings
+import sys
 import numpy as np
 import matplotlib.colors as mcolors
 
@@ -63,6 +64,56 @@ def normalize_vector(vector):
         return vector / norm
 
 
+def normalize_matrix(matrix, dtype=np.float32, check_rows=None):
+    """Return 'matrix' as a C-contiguous array whose rows are normalized.
+
+    If the rows already are unit vectors of the right dtype, no copy is made. Zero rows are left unchanged.
+    If 'check_rows' is given, only that many evenly spaced rows are inspected to decide whether the matrix is
+    normalized already, which avoids reading all of a memory-mapped matrix.
+    """
+
+    matrix = np.ascontiguousarray(matrix, dtype=dtype)
+    if check_rows is not None and len(matrix) > check_rows:
+        sample = matrix[np.linspace(0, len(matrix) - 1, num=check_rows, dtype=int)]
+        sample_norms = np.linalg.norm(sample, axis=1)
+        if np.allclose(sample_norms[sample_norms != 0], 1., atol=1e-5):
+            return matrix
+    norms = np.linalg.norm(matrix, axis=1)
+    if np.allclose(norms[norms != 0], 1., atol=1e-5):
+        return matrix
+    norms[norms == 0] = 1.
+    return np.ascontiguousarray(matrix / norms[:, np.newaxis], dtype=dtype)
+
+
+def resident_memory_mb():
+    """Return the resident memory of the current process in megabytes, and whether it is the peak rather than the
+    current resident memory.
+
+    Reads /proc/self/statm where available (Linux), otherwise falls back to the peak resident memory. Returns nan
+    on platforms without the Unix 'resource' module (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return float("nan"), False
+
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * resource.getpagesize() / 1024**2, False
+    except (OSError, IndexError, ValueError):
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024**2 if sys.platform == "darwin" else 1024), True
+
+
+def describe_resident_memory():
+    """Return a description of the resident memory of the current process for log messages, see
+    resident_memory_mb()."""
+    megabytes, peak = resident_memory_mb()
+    return "{}resident memory of this process: {:.1f} MB".format("peak " if peak else "", megabytes)
+
+
 def cell_colour(s, columns=None):
     """Can be used to colour cells in dataframe: df.style.apply(cell_colour)"""
     if columns is not None: